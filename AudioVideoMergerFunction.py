@@ -1,11 +1,19 @@
 import boto3
+import hashlib
 import json
 import os
 import time
+import random
+import re
 import logging
-from typing import Dict, Any, Tuple
-from urllib.parse import unquote_plus
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlparse
+from botocore.config import Config
+from botocore.exceptions import ClientError, WaiterError
+from botocore.waiter import WaiterModel, create_waiter_with_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,262 +22,701 @@ SLEEP_SECONDS = 15
 MAX_MONITORING_TIME = 900
 INPUT_BUCKET = os.environ['SOURCE_BUCKET']
 OUTPUT_BUCKET = os.environ['DESTINATION_BUCKET']
+REGION = os.environ.get('AWS_REGION', 'us-east-1')
+MEDIACONVERT_ROLE_ARN = os.environ['MEDIACONVERT_ROLE_ARN']
+NARRATION_TOPIC_ARN = os.environ.get('NARRATION_TOPIC_ARN')
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE')
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+# A claim with no work recorded after a full Lambda timeout belongs to an invocation that died
+STALE_CLAIM_SECONDS = MAX_MONITORING_TIME
+S3_URI_PATTERN = re.compile(r's3://([^/]+)/(.+)')
+RETRYABLE_S3_ERRORS = {'500', '503', 'InternalError', 'ServiceUnavailable', 'SlowDown', 'RequestTimeout'}
 
+# MediaConvert doesn't ship a waiter for GetJob, so define one here
+MEDIACONVERT_WAITER_MODEL = WaiterModel({
+    "version": 2,
+    "waiters": {
+        "JobComplete": {
+            "operation": "GetJob",
+            "delay": 10,
+            "maxAttempts": 90,
+            "acceptors": [
+                {"matcher": "path", "argument": "Job.Status", "expected": "COMPLETE", "state": "success"},
+                {"matcher": "path", "argument": "Job.Status", "expected": "ERROR", "state": "failure"},
+                {"matcher": "path", "argument": "Job.Status", "expected": "CANCELED", "state": "failure"}
+            ]
+        }
+    }
+})
+
+# Every merge uses the same settings; only the queue, inputs and destination are filled in per job
+JOB_SETTINGS_TEMPLATE = {
+    "UserMetadata": {},
+    "Role": MEDIACONVERT_ROLE_ARN,
+    "Settings": {
+        "TimecodeConfig": {
+            "Source": "ZEROBASED"
+        },
+        "OutputGroups": [
+            {
+                "CustomName": "output",
+                "Name": "File Group",
+                "Outputs": [
+                    {
+                        "ContainerSettings": {
+                            "Container": "MP4",
+                            "Mp4Settings": {}
+                        },
+                        "VideoDescription": {
+                            "CodecSettings": {
+                                "Codec": "H_264",
+                                "H264Settings": {
+                                    "MaxBitrate": 5000000,
+                                    "RateControlMode": "QVBR",
+                                    "SceneChangeDetect": "TRANSITION_DETECTION"
+                                }
+                            }
+                        },
+                        "AudioDescriptions": [
+                            {
+                                "AudioSourceName": "Audio Selector 2",
+                                "AudioNormalizationSettings": {
+                                    "Algorithm": "ITU_BS_1770_3",
+                                    "AlgorithmControl": "CORRECT_AUDIO",
+                                    "TargetLkfs": -23
+                                },
+                                "CodecSettings": {
+                                    "Codec": "AAC",
+                                    "AacSettings": {
+                                        "Bitrate": 96000,
+                                        "CodingMode": "CODING_MODE_2_0",
+                                        "SampleRate": 48000
+                                    }
+                                }
+                            }
+                        ]
+                    }
+                ],
+                "OutputGroupSettings": {
+                    "Type": "FILE_GROUP_SETTINGS",
+                    "FileGroupSettings": {
+                        "Destination": "",
+                        "DestinationSettings": {
+                            "S3Settings": {
+                                "StorageClass": "STANDARD"
+                            }
+                        }
+                    }
+                }
+            }
+        ],
+        "Inputs": []
+    },
+    "AccelerationSettings": {
+        "Mode": "DISABLED"
+    },
+    "StatusUpdateInterval": "SECONDS_60",
+    "Priority": 0
+}
+
+# Decoding the pre-serialized template is a cheaper fresh copy than deepcopy's per-node walk
+JOB_SETTINGS_TEMPLATE_JSON = json.dumps(JOB_SETTINGS_TEMPLATE)
+
+# Shared by every client so pooled connections stay open across warm invocations. Every
+# call here is a small control-plane request, so short timeouts surface a dead socket
+# in seconds rather than after the 60s default; at most three calls run concurrently
+CLIENT_CONFIG = Config(
+    max_pool_connections=4,
+    retries={'mode': 'adaptive', 'max_attempts': 3},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=10
+)
+
+# Clients are created once per container and reused across warm invocations
+s3_client = boto3.client('s3', config=CLIENT_CONFIG)
+polly_client = boto3.client('polly', config=CLIENT_CONFIG)
+sts_client = boto3.client('sts', config=CLIENT_CONFIG)
+states_client = boto3.client('stepfunctions', config=CLIENT_CONFIG)
+dynamodb_client = boto3.client('dynamodb', config=CLIENT_CONFIG)
+
+@dataclass
+class MergeRequest:
+    """Validated input for the prepare stage and the direct, single-call merge"""
+    story_id: str
+    video_path: str
+    polly_input: Optional[str] = None
+    audio_key: Optional[str] = None
+    polly_task_id: Optional[str] = None
+
+    @classmethod
+    def from_event(cls, event):
+        request = cls(**{field.name: event.get(field.name) for field in fields(cls)})
+        if not request.story_id or not request.video_path or not (request.polly_input or request.audio_key):
+            raise ValueError('Missing required parameters')
+        if not request.video_path.startswith('s3://') or not S3_URI_PATTERN.match(request.video_path):
+            raise ValueError(f"video_path must be an s3://bucket/key URI: {request.video_path}")
+        return request
+
+def sleep_with_backoff(attempt, base=1, cap=30):
+    """Sleep for a "full jitter" exponential backoff so concurrent pollers don't synchronize"""
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+def wait_with_backoff(waiter, max_attempts, base=1, cap=30, **kwargs):
+    """Evaluate the waiter's acceptors once per attempt, sleeping with jittered backoff in between"""
+    for attempt in range(max_attempts):
+        try:
+            waiter.wait(WaiterConfig={'Delay': base, 'MaxAttempts': 1}, **kwargs)
+            return
+        except WaiterError as e:
+            if 'Max attempts exceeded' not in str(e) or attempt == max_attempts - 1:
+                raise
+        sleep_with_backoff(attempt, base, cap)
+
+@lru_cache(maxsize=1)
 def get_mediaconvert_endpoint():
+    # The account endpoint never changes, so describe_endpoints runs once per container
+    endpoint_url = os.environ.get('MEDIACONVERT_ENDPOINT')
+    if endpoint_url:
+        return endpoint_url
     try:
-        mediaconvert_client = boto3.client('mediaconvert')
+        mediaconvert_client = boto3.client('mediaconvert', config=CLIENT_CONFIG)
         response = mediaconvert_client.describe_endpoints()
         return response['Endpoints'][0]['Url']
     except Exception as e:
-        logger.error(f"Error getting MediaConvert endpoint: {str(e)}")
+        logger.error("Error getting MediaConvert endpoint: %s", e)
         raise
 
-def verify_file_exists(s3_client, bucket, key, max_attempts=10, delay=5):
+@lru_cache(maxsize=None)
+def get_mediaconvert_client(endpoint_url):
+    return boto3.client('mediaconvert', endpoint_url=endpoint_url, config=CLIENT_CONFIG)
+
+@lru_cache(maxsize=1)
+def get_account_id():
+    return sts_client.get_caller_identity()['Account']
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first request doesn't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# Runs during the init phase, once per container
+warm_client(s3_client, 'HeadObject', 'ListObjectsV2', 'GetObject', 'PutObject')
+warm_client(polly_client, 'StartSpeechSynthesisTask', 'GetSpeechSynthesisTask')
+warm_client(sts_client, 'GetCallerIdentity')
+warm_client(states_client, 'SendTaskSuccess', 'SendTaskFailure')
+warm_client(dynamodb_client, 'PutItem', 'GetItem', 'UpdateItem', 'DeleteItem')
+try:
+    # Resolving the endpoint here keeps describe_endpoints (rate limited) off the request path
+    warm_client(get_mediaconvert_client(get_mediaconvert_endpoint()), 'CreateJob', 'GetJob')
+except Exception as e:
+    # lru_cache doesn't store failures, so the first job submission retries the lookup
+    logger.warning("Deferring MediaConvert client setup: %s", e)
+
+try:
+    # The queue ARN needs the account ID; fetch it now so STS isn't called per request
+    get_account_id()
+except Exception as e:
+    logger.warning("Deferring account ID lookup: %s", e)
+
+def verify_file_exists(s3_client, bucket, key, max_attempts=3, delay=1):
     """
-    Verify that a file exists in S3 with retries and alternative extension check
+    Verify that a file exists in S3. A 404 is final, so only throttling
+    and 5xx responses are retried.
     """
-    logger.info(f"Verifying file existence - Bucket: {bucket}, Key: {key}")
+    logger.info("Verifying file existence", extra={'bucket': bucket, 'key': key})
     
-    # List of possible file paths to check
-    paths_to_check = [
-        key,  # Original path
-        f"{key}.mp4",  # Path with additional .mp4
-        key[:-4] if key.endswith('.mp4') else f"{key}.mp4"  # Handle both cases
-    ]
+    for attempt in range(max_attempts):
+        try:
+            s3_client.head_object(Bucket=bucket, Key=key)
+            logger.info("File found at path: %s", key)
+            return True
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code not in RETRYABLE_S3_ERRORS or attempt == max_attempts - 1:
+                logger.error("File not found at path: %s", key)
+                return False
+            sleep_with_backoff(attempt, base=delay, cap=10)
+    return False
+
+def wait_for_mediaconvert_job(mediaconvert_client, job_id, max_attempts=30, delay=30):
+    logger.info("Waiting for MediaConvert job", extra={'job_id': job_id})
     
-    for path in paths_to_check:
-        for attempt in range(max_attempts):
-            try:
-                s3_client.head_object(Bucket=bucket, Key=path)
-                logger.info(f"File found at path: {path}")
-                return True, path
-            except Exception as e:
-                if attempt == max_attempts - 1:
-                    logger.info(f"File not found at path: {path}")
-                    continue  # Try next path if available
-                time.sleep(delay)
+    waiter = create_waiter_with_client('JobComplete', MEDIACONVERT_WAITER_MODEL, mediaconvert_client)
+    try:
+        wait_with_backoff(waiter, max_attempts, base=1, cap=delay, Id=job_id)
+    except WaiterError as e:
+        job = (e.last_response or {}).get('Job', {})
+        if job.get('Status') in ['ERROR', 'CANCELED']:
+            error_message = job.get('ErrorMessage', 'Unknown error')
+            logger.error("MediaConvert job failed: %s", error_message)
+            return False, error_message
+        if 'Max attempts exceeded' in str(e):
+            return False, "Timeout waiting for MediaConvert job"
+        logger.error("Error checking MediaConvert job: %s", e)
+        return False, str(e)
     
-    logger.error(f"File not found in any expected location after {max_attempts} attempts")
-    return False, None
+    logger.info("MediaConvert job completed successfully")
+    return True, None
+
+def get_job_settings():
+    """Return a fresh copy of the job template, bound to this account's default queue"""
+    job_settings = json.loads(JOB_SETTINGS_TEMPLATE_JSON)
+    job_settings['Queue'] = f"arn:aws:mediaconvert:{REGION}:{get_account_id()}:queues/Default"
+    return job_settings
 
-def wait_for_mediaconvert_job(mediaconvert_client, job_id, max_attempts=30, delay=10):
-    logger.info(f"Waiting for MediaConvert job {job_id} to complete")
+def get_polly_output_file(polly_client, s3_client, bucket, audio_key, task_id, timeout=600, cap=15, status_every=4):
+    """
+    Wait for the narration to appear at its deterministic key and return the key
+    with its head_object response, which doubles as the existence check.
+    S3 is probed directly; Polly is only asked every few probes whether the task
+    failed, since a failed task never writes the object.
+    """
+    logger.info("Waiting for Polly file", extra={'bucket': bucket, 'key': audio_key, 'task_id': task_id})
     
-    for attempt in range(max_attempts):
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
         try:
-            response = mediaconvert_client.get_job(Id=job_id)
-            status = response['Job']['Status']
-            
-            logger.info(f"MediaConvert job status (Attempt {attempt + 1}/{max_attempts}): {status}")
-            
-            if status == 'COMPLETE':
-                logger.info("MediaConvert job completed successfully")
-                time.sleep(15)  # Added delay after completion
-                return True, None
-            elif status in ['ERROR', 'CANCELED']:
-                error_message = response['Job'].get('ErrorMessage', 'Unknown error')
-                logger.error(f"MediaConvert job failed: {error_message}")
-                return False, error_message
-            
-            logger.info(f"Waiting {delay} seconds before next check...")
-            time.sleep(delay)
-            
-        except Exception as e:
-            logger.error(f"Error checking MediaConvert job: {str(e)}")
-            if attempt == max_attempts - 1:
-                return False, str(e)
-            time.sleep(delay)
+            head_response = s3_client.head_object(Bucket=bucket, Key=audio_key)
+            logger.info("Found Polly output file: %s", audio_key)
+            return audio_key, head_response
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                logger.error("Error checking Polly file: %s", e)
+                raise
+        
+        if attempt % status_every == status_every - 1:
+            task = polly_client.get_speech_synthesis_task(TaskId=task_id)['SynthesisTask']
+            if task['TaskStatus'] == 'failed':
+                error_message = task.get('TaskStatusReason', 'Unknown error')
+                logger.error("Polly task failed: %s", error_message)
+                raise Exception(f"Polly task failed: {error_message}")
+        
+        if time.monotonic() >= deadline:
+            raise Exception(f"Timeout waiting for Polly file after {timeout} seconds")
+        # Short narrations finish in seconds, so start probing after ~1s and back off to 15s
+        sleep_with_backoff(attempt, base=1, cap=cap)
+        attempt += 1
+
+def build_merge_job(story_id, input_paths, job_settings):
+    """Fill in job settings that mux the narration onto the video, and return them with the output key"""
     
-    return False, "Timeout waiting for MediaConvert job"
+    job_settings['Settings']['Inputs'] = [{
+        # Nova Reel video is silent, so the narration is the only audio source
+        'AudioSelectors': {
+            'Audio Selector 2': {
+                'DefaultSelection': 'DEFAULT',
+                'ExternalAudioFileInput': input_paths['audio'],
+                'SelectorType': 'TRACK',
+                'Tracks': [1],
+                'Offset': 0,
+                'ProgramSelection': 1
+            }
+        },
+        'VideoSelector': {},
+        'TimecodeSource': 'ZEROBASED',
+        'FileInput': input_paths['video']
+    }]
+    
+    output_key = f"{story_id}/final/final_output"  # Removed .mp4 extension
+    job_settings['Settings']['OutputGroups'][0]['OutputGroupSettings']['FileGroupSettings']['Destination'] = \
+        f"s3://{OUTPUT_BUCKET}/{output_key}"
+    # Carried on the job's state change events so they can be tied back to the story
+    job_settings['UserMetadata']['story_id'] = story_id
+    
+    return job_settings, output_key
 
-def get_job_settings():
-    sts_client = boto3.client('sts')
-    account_id = sts_client.get_caller_identity()['Account']
-    region = os.environ.get('AWS_REGION', 'us-east-1')
+def get_job_output_uri(job):
+    """Return the S3 URI of the MP4 written by a MediaConvert job"""
+    # GetJob's OutputGroupDetails only carries durations and video details, so the
+    # file name comes from the output group destination the job actually ran with
+    output_group = job['Settings']['OutputGroups'][0]
+    destination = output_group['OutputGroupSettings']['FileGroupSettings']['Destination']
+    name_modifier = output_group['Outputs'][0].get('NameModifier', '')
+    return f"{destination}{name_modifier}.mp4"
+
+def finalize_merge(story_id, job, task_id, input_paths):
+    """Verify the MediaConvert output and build the handler response"""
+    output_uri = get_job_output_uri(job)
+    output_bucket, output_key = S3_URI_PATTERN.match(output_uri).groups()
+    output_prefix = output_key.rsplit('/', 1)[0] + '/'
+    
+    # One listing of the output folder finds the file whatever suffix it ended up with;
+    # a single short retry covers a listing taken just as the job finished
+    actual_output_key = None
+    try:
+        for attempt in range(2):
+            response = s3_client.list_objects_v2(Bucket=output_bucket, Prefix=output_prefix)
+            keys = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith('.mp4')]
+            if keys:
+                actual_output_key = output_key if output_key in keys else keys[0]
+                break
+            if attempt == 0:
+                time.sleep(2)
+    except ClientError as e:
+        logger.error("Error listing MediaConvert output at %s: %s", output_uri, e)
+    
+    if not actual_output_key:
+        logger.error("MediaConvert output not found at %s", output_uri)
+        return {
+            'statusCode': 500,
+            'body': {
+                'message': 'MediaConvert output file not found',
+                'story_id': story_id,
+                'job_id': job['Id'],
+                'output_location': output_uri
+            }
+        }
     
     return {
-        "Queue": f"arn:aws:mediaconvert:{region}:{account_id}:queues/Default",
-        "UserMetadata": {},
-        "Role": os.environ['MEDIACONVERT_ROLE_ARN'],
-        "Settings": {
-            "TimecodeConfig": {
-                "Source": "ZEROBASED"
-            },
-            "OutputGroups": [
+        'statusCode': 200,
+        'body': {
+            'message': 'Processing completed successfully',
+            'mediaconvert_job_id': job['Id'],
+            'polly_task_id': task_id,
+            'story_id': story_id,
+            'input_paths': input_paths,
+            'output_path': f"s3://{output_bucket}/{actual_output_key}",
+            'status': {
+                'polly': 'COMPLETED',
+                'mediaconvert': 'COMPLETED'
+            }
+        }
+    }
+
+def start_narration(story_id, polly_input, notification_context=None):
+    """
+    Start the Polly synthesis task for the narration and return its task ID
+    and the key the audio will be written to.
+    With a notification context (a Step Functions task token, or the inputs
+    for the merge job), completion is handled from the narration SNS topic
+    instead of being polled.
+    """
+    logger.info("Starting Polly synthesis", extra={'story_id': story_id})
+    
+    timestamp = int(time.time())
+    audio_prefix = f"{story_id}/audio/speech_{timestamp}"
+    
+    notification = {}
+    if notification_context:
+        # Stored before the task starts so the notification can never arrive first
+        s3_client.put_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=f"{audio_prefix}.json",
+            Body=json.dumps(notification_context),
+            ContentType='application/json'
+        )
+        notification['SnsTopicArn'] = NARRATION_TOPIC_ARN
+    
+    polly_response = polly_client.start_speech_synthesis_task(
+        Engine='neural',
+        LanguageCode='en-US',
+        OutputFormat='mp3',
+        OutputS3BucketName=OUTPUT_BUCKET,
+        OutputS3KeyPrefix=audio_prefix,
+        Text=polly_input,
+        VoiceId='Ruth',
+        SampleRate='24000',
+        TextType='text',
+        **notification
+    )
+    
+    task_id = polly_response['SynthesisTask']['TaskId']
+    logger.info("Polly task started", extra={'task_id': task_id})
+    # Polly always writes <prefix>.<task id>.<format>
+    return task_id, f"{audio_prefix}.{task_id}.mp3"
+
+def submit_merge_job(story_id, task_id, input_paths):
+    """Create the MediaConvert job for a finished narration without waiting on it"""
+    job_settings, output_key = build_merge_job(story_id, input_paths, get_job_settings())
+    # Completion arrives on the MergeCompletionRule EventBridge rule, which matches this marker
+    job_settings['UserMetadata'].update({
+        'completion': 'event',
+        'polly_task_id': task_id,
+        'input_paths': json.dumps(input_paths)
+    })
+    mediaconvert_client = get_mediaconvert_client(get_mediaconvert_endpoint())
+    job_id = mediaconvert_client.create_job(**job_settings)['Job']['Id']
+    logger.info("MediaConvert job submitted", extra={'story_id': story_id, 'job_id': job_id, 'polly_task_id': task_id, 'output_key': output_key})
+    return job_id
+
+def handle_narration_notification(event):
+    """
+    Act on each Polly completion message: resume the waiting state machine
+    task, or submit the merge job for a narration started with stage='start'.
+    """
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        task_id = message['taskId']
+        # outputUri is path-style (https://s3.<region>.amazonaws.com/<bucket>/<key>)
+        output_key = urlparse(message['outputUri']).path.split('/', 2)[-1]
+        # Polly names the file <prefix>.<task id>.mp3, and the context was stored at <prefix>.json
+        audio_prefix = output_key.rsplit('.', 2)[0]
+        
+        context_object = s3_client.get_object(Bucket=OUTPUT_BUCKET, Key=f"{audio_prefix}.json")
+        notification_context = json.loads(context_object['Body'].read())
+        task_token = notification_context.get('task_token')
+        completed = message['taskStatus'].lower() == 'completed'
+        
+        if completed:
+            logger.info("Polly task completed", extra={'task_id': task_id, 'output_key': output_key})
+        else:
+            logger.error("Polly task %s failed: %s", task_id, message.get('taskStatusReason'))
+        
+        if task_token and completed:
+            states_client.send_task_success(
+                taskToken=task_token,
+                output=json.dumps({'polly_task_id': task_id, 'audio_key': output_key})
+            )
+        elif task_token:
+            states_client.send_task_failure(
+                taskToken=task_token,
+                error='PollyTaskFailed',
+                cause=message.get('taskStatusReason') or 'Unknown error'
+            )
+        elif completed:
+            submit_merge_job(
+                notification_context['story_id'],
+                task_id,
                 {
-                    "CustomName": "output",
-                    "Name": "File Group",
-                    "Outputs": [
-                        {
-                            "ContainerSettings": {
-                                "Container": "MP4",
-                                "Mp4Settings": {}
-                            },
-                            "VideoDescription": {
-                                "CodecSettings": {
-                                    "Codec": "H_264",
-                                    "H264Settings": {
-                                        "MaxBitrate": 5000000,
-                                        "RateControlMode": "QVBR",
-                                        "SceneChangeDetect": "TRANSITION_DETECTION"
-                                    }
-                                }
-                            },
-                            "AudioDescriptions": [
-                                {
-                                    "AudioSourceName": "Audio Selector 2",
-                                    "AudioNormalizationSettings": {
-                                        "Algorithm": "ITU_BS_1770_3",
-                                        "AlgorithmControl": "CORRECT_AUDIO",
-                                        "TargetLkfs": -23
-                                    },
-                                    "CodecSettings": {
-                                        "Codec": "AAC",
-                                        "AacSettings": {
-                                            "Bitrate": 96000,
-                                            "CodingMode": "CODING_MODE_2_0",
-                                            "SampleRate": 48000
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    "OutputGroupSettings": {
-                        "Type": "FILE_GROUP_SETTINGS",
-                        "FileGroupSettings": {
-                            "Destination": "",
-                            "DestinationSettings": {
-                                "S3Settings": {
-                                    "StorageClass": "STANDARD"
-                                }
-                            }
-                        }
-                    }
+                    'video': notification_context['video_path'],
+                    'audio': f"s3://{OUTPUT_BUCKET}/{output_key}"
                 }
-            ],
-            "Inputs": []
-        },
-        "AccelerationSettings": {
-            "Mode": "DISABLED"
-        },
-        "StatusUpdateInterval": "SECONDS_60",
-        "Priority": 0
-    }
+            )
+    
+    return {'statusCode': 200}
 
-def get_polly_output_file(s3_client, bucket, prefix, task_id, max_attempts=60, delay=10):
-    logger.info(f"Waiting for Polly file in bucket: {bucket}, prefix: {prefix}, task_id: {task_id}")
+def claim_merge(story_id, narration):
+    """
+    Record that a merge for this story and narration has started. The narration
+    is the Polly input text, or the audio key of an already narrated merge.
+    Returns None for a new merge, or the stored polly_task_id/audio_key/
+    mediaconvert_job_id of an earlier run with the same narration.
+    """
+    input_hash = hashlib.sha256(narration.encode('utf-8')).hexdigest()[:16]
+    now = int(time.time())
+    item = {
+        'story_id': {'S': story_id},
+        'input_hash': {'S': input_hash},
+        'claimed_at': {'N': str(now)},
+        'expires_at': {'N': str(now + IDEMPOTENCY_TTL_SECONDS)}
+    }
+    try:
+        dynamodb_client.put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item=item,
+            ConditionExpression='attribute_not_exists(story_id)'
+        )
+        return None
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
     
-    for attempt in range(max_attempts):
+    existing = dynamodb_client.get_item(
+        TableName=IDEMPOTENCY_TABLE,
+        Key={'story_id': {'S': story_id}},
+        ConsistentRead=True
+    ).get('Item', {})
+    if existing.get('input_hash', {}).get('S') == input_hash:
+        previous = {name: value['S'] for name, value in existing.items() if 'S' in value}
+        claimed_at = int(existing.get('claimed_at', {}).get('N', '0'))
+        if previous.get('polly_task_id') or previous.get('mediaconvert_job_id') or now - claimed_at < STALE_CLAIM_SECONDS:
+            return previous
+        
+        # Nothing was recorded and the claimant can no longer be running, so take the claim over;
+        # the condition makes sure only one retry does
         try:
-            polly_client = boto3.client('polly')
-            task_status = polly_client.get_speech_synthesis_task(TaskId=task_id)
-            task_state = task_status['SynthesisTask']['TaskStatus']
-            
-            logger.info(f"Polly task status (Attempt {attempt + 1}/{max_attempts}): {task_state}")
-            
-            if task_state == 'completed':
-                output_uri = task_status['SynthesisTask']['OutputUri']
-                output_key = output_uri.split(bucket + '/')[-1]
-                logger.info(f"Found Polly output file: {output_key}")
-                return output_key
-                
-            elif task_state == 'failed':
-                error_message = task_status['SynthesisTask'].get('TaskStatusReason', 'Unknown error')
-                logger.error(f"Polly task failed: {error_message}")
-                raise Exception(f"Polly task failed: {error_message}")
-            
-            logger.info(f"Polly task still processing. Waiting {delay} seconds...")
-            time.sleep(delay)
-            
-        except Exception as e:
-            logger.error(f"Error checking Polly file: {str(e)}")
-            if attempt == max_attempts - 1:
+            dynamodb_client.put_item(
+                TableName=IDEMPOTENCY_TABLE,
+                Item=item,
+                ConditionExpression='attribute_not_exists(claimed_at) OR claimed_at = :claimed_at',
+                ExpressionAttributeValues={':claimed_at': {'N': str(claimed_at)}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
                 raise
-            time.sleep(delay)
+            return previous
+        logger.warning("Taking over a stale merge claim for %s", story_id)
+        return None
+    
+    # New narration text for the same story is a new merge
+    dynamodb_client.put_item(TableName=IDEMPOTENCY_TABLE, Item=item)
+    return None
+
+def release_merge(story_id):
+    """Forget a failed merge so a retry starts over instead of reusing its work"""
+    try:
+        dynamodb_client.delete_item(TableName=IDEMPOTENCY_TABLE, Key={'story_id': {'S': story_id}})
+    except ClientError as e:
+        logger.error("Error releasing merge for %s: %s", story_id, e)
+
+def record_merge(story_id, **ids):
+    """Store the IDs of the work started for a claimed merge"""
+    dynamodb_client.update_item(
+        TableName=IDEMPOTENCY_TABLE,
+        Key={'story_id': {'S': story_id}},
+        UpdateExpression='SET ' + ', '.join(f"{name} = :{name}" for name in ids),
+        ExpressionAttributeValues={f":{name}": {'S': value} for name, value in ids.items()}
+    )
+
+def handle_job_state_change(event):
+    """Verify the output of a merge job submitted from a narration notification"""
+    detail = event['detail']
+    metadata = detail.get('userMetadata', {})
+    story_id = metadata.get('story_id')
+    
+    if detail['status'] != 'COMPLETE':
+        logger.error("MediaConvert job %s for %s ended with %s: %s",
+                     detail['jobId'], story_id, detail['status'], detail.get('errorMessage'))
+        return {'statusCode': 500, 'body': {'story_id': story_id, 'job_id': detail['jobId']}}
     
-    raise Exception(f"Timeout waiting for Polly file after {max_attempts} attempts")
+    mediaconvert_client = get_mediaconvert_client(get_mediaconvert_endpoint())
+    job = mediaconvert_client.get_job(Id=detail['jobId'])['Job']
+    result = finalize_merge(story_id, job, metadata.get('polly_task_id'), json.loads(metadata['input_paths']))
+    logger.info("Merge finished", extra={'story_id': story_id, 'result': result})
+    return result
 
 def lambda_handler(event, context):
+    """
+    Runs the whole merge by default. With stage='start' it returns once Polly
+    is running; the narration SNS notification then submits the MediaConvert
+    job and its EventBridge completion event verifies the output.
+    The state machine instead calls it with stage='narrate' (start Polly and
+    wait on its SNS notification), stage='prepare' (job settings) and, after
+    its createJob.sync step, with stage='finalize' (output verification).
+    """
+    if 'Records' in event:
+        return handle_narration_notification(event)
+    
+    if event.get('source') == 'aws.mediaconvert':
+        return handle_job_state_change(event)
+    
+    if event.get('stage') == 'narrate':
+        if not event.get('story_id') or not event.get('polly_input') or not event.get('task_token'):
+            raise ValueError('story_id, polly_input and task_token are required')
+        # Errors propagate so the waiting task fails instead of timing out
+        task_id, _ = start_narration(event['story_id'], event['polly_input'], {'task_token': event['task_token']})
+        return {'statusCode': 202, 'body': {'polly_task_id': task_id}}
+    
+    if event.get('stage') == 'finalize':
+        return finalize_merge(
+            event.get('story_id'),
+            event['job'],
+            event.get('polly_task_id'),
+            event.get('input_paths')
+        )
+    
+    story_id = None
+    idempotent = False
+    # A claimed merge is released on every way out except success, or a failure that
+    # leaves work on the claim for a retry to reuse
+    claimed = False
+    keep_claim = False
     try:
-        s3_client = boto3.client('s3')
-        polly_client = boto3.client('polly')
-        
-        endpoint_url = os.environ.get('MEDIACONVERT_ENDPOINT')
-        if not endpoint_url:
-            endpoint_url = get_mediaconvert_endpoint()
+        try:
+            request = MergeRequest.from_event(event)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': {
+                    'message': str(e),
+                    'story_id': event.get('story_id')
+                }
+            }
         
-        mediaconvert_client = boto3.client('mediaconvert', endpoint_url=endpoint_url)
+        story_id = request.story_id
+        polly_input = request.polly_input
+        video_path = request.video_path
+        audio_key = request.audio_key
         
-        story_id = event.get('story_id')
-        polly_input = event.get('polly_input')
-        video_path = event.get('video_path')
+        video_bucket, video_key = S3_URI_PATTERN.match(video_path).groups()
+        logger.info("Parsed video path", extra={'bucket': video_bucket, 'key': video_key})
         
-        if not story_id or not polly_input or not video_path:
+        # A retried single-call merge picks up the Polly task and MediaConvert job it already started
+        idempotent = bool(IDEMPOTENCY_TABLE) and not event.get('stage')
+        # A merge handed an audio_key never runs Polly, so that key identifies its narration
+        previous = claim_merge(story_id, audio_key or polly_input) if idempotent else None
+        if previous is not None and not (previous.get('polly_task_id') or previous.get('mediaconvert_job_id')):
             return {
-                'statusCode': 400,
+                'statusCode': 409,
                 'body': {
-                    'message': 'Missing required parameters',
+                    'message': 'A merge for this story is already starting',
                     'story_id': story_id
                 }
             }
-        
-        video_path = video_path.replace('s3://', '')
-        video_bucket = video_path.split('/')[0]
-        path_parts = video_path.split('/')
-        
-        video_key = '/'.join(path_parts[1:])
-        logger.info(f"Parsed video path - Bucket: {video_bucket}, Key: {video_key}")
+        claimed = idempotent
 
-        success, actual_video_key = verify_file_exists(s3_client, video_bucket, video_key)
-        if not success:
-            alternative_key = f"{story_id}/{video_key}"
-            logger.info(f"Trying alternative path: {alternative_key}")
-            
-            success, actual_video_key = verify_file_exists(s3_client, video_bucket, alternative_key)
-            if success:
-                video_key = actual_video_key
-                logger.info(f"Found video at alternative path")
+        # The input check, Polly submission, job settings (account ID) and MediaConvert
+        # endpoint lookups are independent, so overlap them
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            video_future = executor.submit(verify_file_exists, s3_client, video_bucket, video_key)
+            # stage='start' hands the merge to the SNS notification, so Polly waits for a confirmed input
+            if audio_key or previous or event.get('stage') == 'start':
+                polly_future = None
             else:
-                return {
-                    'statusCode': 500,
-                    'body': {
-                        'message': f'Input video file not found',
-                        'story_id': story_id
-                    }
+                polly_future = executor.submit(start_narration, story_id, polly_input)
+            settings_future = executor.submit(get_job_settings)
+            # Only the single-call merge submits the job from here; a no-op once init resolved it
+            if event.get('stage') in ('prepare', 'start'):
+                endpoint_future = None
+            else:
+                endpoint_future = executor.submit(get_mediaconvert_endpoint)
+        
+        if not video_future.result():
+            if claimed and polly_future is not None:
+                # Polly tasks can't be cancelled, so record this one for the retry to reuse
+                task_id, expected_audio_key = polly_future.result()
+                record_merge(story_id, polly_task_id=task_id, audio_key=expected_audio_key)
+            keep_claim = claimed and (polly_future is not None or bool(previous and previous.get('polly_task_id')))
+            return {
+                'statusCode': 500,
+                'body': {
+                    'message': f'Input video file not found',
+                    'story_id': story_id
                 }
+            }
+        
+        if event.get('stage') == 'start':
+            task_id, _ = start_narration(story_id, polly_input, {
+                'story_id': story_id,
+                'video_path': f"s3://{video_bucket}/{video_key}"
+            })
+            return {
+                'statusCode': 202,
+                'body': {
+                    'message': 'Narration started; the merge job is submitted when it completes',
+                    'polly_task_id': task_id,
+                    'story_id': story_id
+                }
+            }
         
         try:
-            logger.info(f"Starting Polly synthesis for story_id: {story_id}")
-            
-            timestamp = int(time.time())
-            audio_prefix = f"{story_id}/audio/speech_{timestamp}"
-            
-            polly_response = polly_client.start_speech_synthesis_task(
-                Engine='neural',
-                LanguageCode='en-US',
-                OutputFormat='mp3',
-                OutputS3BucketName=OUTPUT_BUCKET,
-                OutputS3KeyPrefix=audio_prefix,
-                Text=polly_input,
-                VoiceId='Ruth',
-                SampleRate='24000',
-                TextType='text'
-            )
-            
-            task_id = polly_response['SynthesisTask']['TaskId']
-            logger.info(f"Polly task started with ID: {task_id}")
-            
-            actual_audio_key = get_polly_output_file(
-                s3_client, 
-                OUTPUT_BUCKET, 
-                f"{story_id}/audio/",
-                task_id,
-                max_attempts=60,
-                delay=10
-            )
+            if audio_key:
+                # Already narrated by the state machine's narrate stage
+                task_id = request.polly_task_id
+                actual_audio_key = audio_key
+                audio_found = True
+            else:
+                if previous:
+                    task_id, expected_audio_key = previous['polly_task_id'], previous['audio_key']
+                else:
+                    task_id, expected_audio_key = polly_future.result()
+                    if idempotent:
+                        record_merge(story_id, polly_task_id=task_id, audio_key=expected_audio_key)
+                
+                actual_audio_key, audio_head = get_polly_output_file(
+                    polly_client,
+                    s3_client, 
+                    OUTPUT_BUCKET, 
+                    expected_audio_key,
+                    task_id,
+                    timeout=600,
+                    cap=15
+                )
+                audio_found = audio_head['ContentLength'] > 0
             
-            if not actual_audio_key:
+            if not audio_found:
                 return {
                     'statusCode': 500,
                     'body': {
@@ -279,52 +726,44 @@ def lambda_handler(event, context):
                     }
                 }
             
-            logger.info(f"Found Polly output file: {actual_audio_key}")
-            
             try:
-                job_settings = get_job_settings()
+                input_paths = {
+                    'video': f"s3://{video_bucket}/{video_key}",
+                    'audio': f"s3://{OUTPUT_BUCKET}/{actual_audio_key}"
+                }
+                job_settings, output_key = build_merge_job(story_id, input_paths, settings_future.result())
                 
-                job_settings['Settings']['Inputs'] = [{
-                    'AudioSelectors': {
-                        'Audio Selector 1': {
-                            'DefaultSelection': 'DEFAULT',
-                            'SelectorType': 'TRACK',
-                            'Tracks': [1],
-                            'Offset': 0
-                        },
-                        'Audio Selector 2': {
-                            'DefaultSelection': 'DEFAULT',
-                            'ExternalAudioFileInput': f"s3://{OUTPUT_BUCKET}/{actual_audio_key}",
-                            'SelectorType': 'TRACK',
-                            'Tracks': [1],
-                            'Offset': 0,
-                            'ProgramSelection': 1
-                        }
-                    },
-                    'AudioSelectorGroups': {
-                        'Audio Selector Group 1': {
-                            'AudioSelectorNames': ['Audio Selector 2']
+                if event.get('stage') == 'prepare':
+                    # The state machine submits the job with createJob.sync, so no Lambda time is spent waiting on it
+                    return {
+                        'statusCode': 200,
+                        'body': {
+                            'message': 'MediaConvert job prepared',
+                            'polly_task_id': task_id,
+                            'story_id': story_id,
+                            'input_paths': input_paths,
+                            'output_key': output_key,
+                            'job_settings': job_settings
                         }
-                    },
-                    'VideoSelector': {},
-                    'TimecodeSource': 'ZEROBASED',
-                    'FileInput': f"s3://{video_bucket}/{video_key}"
-                }]
-                
-                output_key = f"{story_id}/final/final_output"  # Removed .mp4 extension
-                job_settings['Settings']['OutputGroups'][0]['OutputGroupSettings']['FileGroupSettings']['Destination'] = \
-                    f"s3://{OUTPUT_BUCKET}/{output_key}"
+                    }
                 
-                logger.info(f"Creating MediaConvert job for story_id: {story_id}")
+                logger.info("Creating MediaConvert job", extra={'story_id': story_id})
                 
-                mediaconvert_response = mediaconvert_client.create_job(**job_settings)
-                job_id = mediaconvert_response['Job']['Id']
+                mediaconvert_client = get_mediaconvert_client(endpoint_future.result())
+                if previous and previous.get('mediaconvert_job_id'):
+                    job_id = previous['mediaconvert_job_id']
+                    logger.info("Reusing MediaConvert job", extra={'story_id': story_id, 'job_id': job_id})
+                else:
+                    mediaconvert_response = mediaconvert_client.create_job(**job_settings)
+                    job_id = mediaconvert_response['Job']['Id']
+                    if idempotent:
+                        record_merge(story_id, mediaconvert_job_id=job_id)
 
                 success, error = wait_for_mediaconvert_job(
                     mediaconvert_client,
                     job_id,
                     max_attempts=30,
-                    delay=10
+                    delay=30
                 )
 
                 if not success:
@@ -337,55 +776,14 @@ def lambda_handler(event, context):
                         }
                     }
 
-                # Add additional delay before checking for the file
-                time.sleep(10)
-
-                # Verify with retries
-                success, actual_output_key = verify_file_exists(
-                    s3_client, 
-                    OUTPUT_BUCKET, 
-                    f"{output_key}.mp4", 
-                    max_attempts=10, 
-                    delay=5
-                )
-                
-                if not success:
-                    return {
-                        'statusCode': 500,
-                        'body': {
-                            'message': 'MediaConvert output file not found after retries',
-                            'story_id': story_id,
-                            'job_id': job_id,
-                            'output_location': f"s3://{OUTPUT_BUCKET}/{output_key}.mp4",
-                            'attempted_paths': [
-                                f"s3://{OUTPUT_BUCKET}/{output_key}.mp4",
-                                f"s3://{OUTPUT_BUCKET}/{output_key}.mp4.mp4"
-                            ]
-                        }
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'body': {
-                        'message': 'Processing completed successfully',
-                        'mediaconvert_job_id': job_id,
-                        'polly_task_id': task_id,
-                        'story_id': story_id,
-                        'input_paths': {
-                            'video': f"s3://{video_bucket}/{video_key}",
-                            'audio': f"s3://{OUTPUT_BUCKET}/{actual_audio_key}"
-                        },
-                        'output_path': f"s3://{OUTPUT_BUCKET}/{actual_output_key}",
-                        'status': {
-                            'polly': 'COMPLETED',
-                            'mediaconvert': 'COMPLETED'
-                        }
-                    }
-                }
+                job = mediaconvert_client.get_job(Id=job_id)['Job']
+                result = finalize_merge(story_id, job, task_id, input_paths)
+                keep_claim = result['statusCode'] == 200
+                return result
                 
             except ClientError as e:
                 error_message = str(e)
-                logger.error(f"MediaConvert error: {error_message}")
+                logger.error("MediaConvert error: %s", error_message)
                 return {
                     'statusCode': 500,
                     'body': {
@@ -397,7 +795,7 @@ def lambda_handler(event, context):
                 
         except ClientError as e:
             error_message = str(e)
-            logger.error(f"Polly error: {error_message}")
+            logger.error("Polly error: %s", error_message)
             return {
                 'statusCode': 500,
                 'body': {
@@ -408,11 +806,15 @@ def lambda_handler(event, context):
             
     except Exception as e:
         error_message = str(e)
-        logger.error(f"General error: {error_message}")
+        logger.error("General error: %s", error_message)
         return {
             'statusCode': 500,
             'body': {
                 'message': f"General error: {error_message}",
-                'story_id': story_id if 'story_id' in locals() else None
+                'story_id': story_id
             }
         }
+    
+    finally:
+        if claimed and not keep_claim:
+            release_merge(story_id)
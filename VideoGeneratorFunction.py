@@ -2,43 +2,56 @@ import json
 import boto3
 import os
 import time
+import random
 import logging
+from dataclasses import dataclass
 from typing import Dict, Any, Tuple
 from urllib.parse import unquote_plus
+from botocore.config import Config
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-SLEEP_SECONDS = 15
+MIN_SLEEP_SECONDS = 5
+MAX_SLEEP_SECONDS = 30
 MAX_MONITORING_TIME = 900
 INPUT_BUCKET = os.environ['SOURCE_BUCKET']
 OUTPUT_BUCKET = os.environ['DESTINATION_BUCKET']
+# Nova Reel output settings live only here; the story generator pre-renders just the shots
+VIDEO_GENERATION_CONFIG = {
+    "fps": 24,
+    "dimension": "1280x720",
+    "seed": 42
+}
 
-def extract_job_id(response):
-    """Extract job ID from Bedrock response"""
-    try:
-        # The requestToken in the response contains the job ID
-        request_token = response.get('requestToken')
-        if request_token:
-            return request_token.split('-')[0]  # First part of the token is the job ID
-        
-        # Alternative: try getting from invocationId
-        invocation_id = response.get('invocationId')
-        if invocation_id:
-            return invocation_id
-        
-        # If neither is available, use part of the invocationArn
-        invocation_arn = response.get('invocationArn', '')
-        return invocation_arn.split('/')[-1]
-        
-    except Exception as e:
-        logger.error(f"Error extracting job ID: {str(e)}")
-        return None
+# Shared by every client so pooled connections stay open across warm invocations
+CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=60
+)
 
-def handler(event, context):
-    s3_client = boto3.client('s3')
-    bedrock_client = boto3.client('bedrock-runtime')
-    
-    try:
+# Clients are created once per container and reused across warm invocations
+s3_client = boto3.client('s3', config=CLIENT_CONFIG)
+bedrock_client = boto3.client('bedrock-runtime', config=CLIENT_CONFIG)
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first request doesn't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# Runs during the init phase, once per container
+warm_client(s3_client, 'GetObject')
+warm_client(bedrock_client, 'StartAsyncInvoke', 'GetAsyncInvoke')
+
+@dataclass
+class VideoRequest:
+    """Validated input for the video generator, from Step Functions or API Gateway"""
+    story_id: str
+
+    @classmethod
+    def from_event(cls, event):
         if isinstance(event, dict):
             if 'body' in event:
                 body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
@@ -50,43 +63,71 @@ def handler(event, context):
         story_id = body.get('story_id')
         if not story_id:
             raise ValueError("story_id is required")
+        return cls(story_id=story_id)
+
+def poll_delay(attempt):
+    """Seconds to wait before the next status check: grows from 5s towards 30s, jittered"""
+    return min(MAX_SLEEP_SECONDS, MIN_SLEEP_SECONDS * 1.5 ** attempt) * random.uniform(0.5, 1.5)
 
-        logger.info(f"Processing story_id: {story_id}")
+def extract_job_id(response):
+    """Extract the job ID (the last segment of the invocation ARN) from a Bedrock response"""
+    invocation_arn = response.get('invocationArn')
+    if not invocation_arn:
+        logger.error("Bedrock response has no invocationArn")
+        return None
+    return invocation_arn.rsplit('/', 1)[-1]
 
-        scene_json_response = s3_client.get_object(
+def load_request_body(story_id):
+    """Load the Nova Reel request pre-rendered by the story generator"""
+    try:
+        response = s3_client.get_object(
             Bucket=INPUT_BUCKET,
-            Key=f"{story_id}/scenes.json"
+            Key=f"{story_id}/video_request.json"
         )
-        scene_data = json.loads(scene_json_response['Body'].read().decode('utf-8'))
-        
-        shots = []
-        for i in range(1, 6):
-            shot = {
-                "text": scene_data[f"shot{i}_text"].strip(),
-                "image": {
-                    "format": "png",
-                    "source": {
-                        "s3Location": {
-                            "uri": f"s3://{INPUT_BUCKET}/{story_id}/scene_{i}.png"
-                        }
+        request_body = json.loads(response['Body'].read())
+        request_body["videoGenerationConfig"] = VIDEO_GENERATION_CONFIG
+        return request_body
+    except s3_client.exceptions.NoSuchKey:
+        logger.info("No pre-rendered request found, building it from scenes.json")
+
+    scene_json_response = s3_client.get_object(
+        Bucket=INPUT_BUCKET,
+        Key=f"{story_id}/scenes.json"
+    )
+    scene_data = json.loads(scene_json_response['Body'].read())
+    
+    shots = [
+        {
+            "text": scene_data[f"shot{i}_text"].strip(),
+            "image": {
+                "format": "png",
+                "source": {
+                    "s3Location": {
+                        "uri": f"s3://{INPUT_BUCKET}/{story_id}/scene_{i}.png"
                     }
                 }
             }
-            shots.append(shot)
-        
-        request_body = {
-            "taskType": "MULTI_SHOT_MANUAL",
-            "multiShotManualParams": {
-                "shots": shots
-            },
-            "videoGenerationConfig": {
-                "fps": 24,
-                "dimension": "1280x720",
-                "seed": 42
-            }
         }
+        for i in range(1, 6)
+    ]
+    
+    return {
+        "taskType": "MULTI_SHOT_MANUAL",
+        "multiShotManualParams": {
+            "shots": shots
+        },
+        "videoGenerationConfig": VIDEO_GENERATION_CONFIG
+    }
+
+def handler(event, context):
+    try:
+        story_id = VideoRequest.from_event(event).story_id
+
+        logger.info("Processing story", extra={'story_id': story_id})
+
+        request_body = load_request_body(story_id)
         
-        logger.info(f"Request body: {json.dumps(request_body, indent=2)}")
+        logger.debug("Request body", extra={'request_body': request_body})
         
         # Start async video generation
         invoke_response = bedrock_client.start_async_invoke(
@@ -103,8 +144,7 @@ def handler(event, context):
         job_id = extract_job_id(invoke_response)
         invocation_arn = invoke_response["invocationArn"]
         
-        logger.info(f"Started async job with ID: {job_id}")
-        logger.info(f"Invocation ARN: {invocation_arn}")
+        logger.info("Started async job", extra={'job_id': job_id, 'invocation_arn': invocation_arn})
         
         status, output_location = monitor_video_generation(
             bedrock_client, 
@@ -132,7 +172,7 @@ def handler(event, context):
         else:
             response['message'] = f'Video generation status: {status}'
             
-        logger.info(f"Final response: {json.dumps(response, default=str)}")
+        logger.info("Final response", extra={'response': response})
         return response
 
     except Exception as err:
@@ -146,32 +186,35 @@ def handler(event, context):
 def monitor_video_generation(bedrock_client, invocation_arn: str, story_id: str, job_id: str) -> Tuple[str, str]:
     start_time = time.time()
     
-    logger.info(f"Monitoring job with ID: {job_id}")
-    expected_path = f"{story_id}/{job_id}/output.mp4"
-    logger.info(f"Expected output path: {expected_path}")
+    logger.info("Monitoring job", extra={'job_id': job_id})
     
+    attempt = 0
     while True:
         try:
             response = bedrock_client.get_async_invoke(invocationArn=invocation_arn)
             status = response["status"]
-            logger.info(f"Status: {status}")
+            logger.info("Video generation status", extra={'status': status, 'attempt': attempt})
             
             if status != "InProgress":
                 break
                     
-            if time.time() - start_time > MAX_MONITORING_TIME:
+            remaining = MAX_MONITORING_TIME - (time.time() - start_time)
+            if remaining <= 0:
                 logger.warning("Maximum monitoring time exceeded")
                 return "Timeout", None
                     
-            time.sleep(SLEEP_SECONDS)
+            time.sleep(min(poll_delay(attempt), remaining))
+            attempt += 1
                 
         except Exception as e:
             logger.error(f"Error monitoring video generation: {str(e)}")
             return "Error", None
 
     if status == "Completed":
-        output_location = f"s3://{OUTPUT_BUCKET}/{expected_path}"
-        logger.info(f"Job completed. Output at: {output_location}")
+        # Nova Reel writes <s3Uri>/<invocation id>/output.mp4; hand that exact key downstream
+        s3_uri = response["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"]
+        output_location = f"{s3_uri.rstrip('/')}/{job_id}/output.mp4"
+        logger.info("Job completed", extra={'output_location': output_location})
         return status, output_location
     
     return status, None
@@ -2,117 +2,214 @@ import boto3
 import json
 import os
 import time
+import random
 from botocore.exceptions import ClientError
 import logging
+from functools import lru_cache
+from urllib.parse import urlparse
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+REGION = os.environ.get('AWS_REGION', 'us-east-1')
+# When set, Polly publishes task results here and the merge runs from the notification
+NARRATION_TOPIC_ARN = os.environ.get('NARRATION_TOPIC_ARN')
+# Stored contexts and task outputs are only read by code, so drop json.dumps' default whitespace
+COMPACT_SEPARATORS = (',', ':')
+
+# Every merge uses the same settings; only the queue, input URIs, destination and metadata are filled in per job
+JOB_SETTINGS_TEMPLATE = {
+    "UserMetadata": {},
+    "Role": os.environ['MEDIACONVERT_ROLE_ARN'],
+    "Settings": {
+        "TimecodeConfig": {
+            "Source": "ZEROBASED"
+        },
+        "OutputGroups": [
+            {
+                "CustomName": "output",
+                "Name": "File Group",
+                "Outputs": [
+                    {
+                        "ContainerSettings": {
+                            "Container": "MP4",
+                            "Mp4Settings": {}
+                        },
+                        "VideoDescription": {
+                            "CodecSettings": {
+                                "Codec": "H_264",
+                                "H264Settings": {
+                                    "MaxBitrate": 5000000,
+                                    "RateControlMode": "QVBR",
+                                    "SceneChangeDetect": "TRANSITION_DETECTION"
+                                }
+                            }
+                        },
+                        "AudioDescriptions": [
+                            {
+                                "AudioSourceName": "Audio Selector 2",
+                                "AudioNormalizationSettings": {
+                                    "Algorithm": "ITU_BS_1770_3",
+                                    "AlgorithmControl": "CORRECT_AUDIO",
+                                    "TargetLkfs": -23
+                                },
+                                "CodecSettings": {
+                                    "Codec": "AAC",
+                                    "AacSettings": {
+                                        "Bitrate": 96000,
+                                        "CodingMode": "CODING_MODE_2_0",
+                                        "SampleRate": 48000
+                                    }
+                                }
+                            }
+                        ]
+                    }
+                ],
+                "OutputGroupSettings": {
+                    "Type": "FILE_GROUP_SETTINGS",
+                    "FileGroupSettings": {
+                        "Destination": "",
+                        "DestinationSettings": {
+                            "S3Settings": {
+                                "StorageClass": "STANDARD"
+                            }
+                        }
+                    }
+                }
+            }
+        ],
+        "Inputs": [
+            {
+                "AudioSelectors": {
+                    "Audio Selector 1": {
+                        "DefaultSelection": "DEFAULT",
+                        "SelectorType": "TRACK",
+                        "Tracks": [1],
+                        "Offset": 0
+                    },
+                    "Audio Selector 2": {
+                        "DefaultSelection": "DEFAULT",
+                        "ExternalAudioFileInput": "",
+                        "SelectorType": "TRACK",
+                        "Tracks": [1],
+                        "Offset": 0,
+                        "ProgramSelection": 1
+                    }
+                },
+                "AudioSelectorGroups": {
+                    "Audio Selector Group 1": {
+                        "AudioSelectorNames": ["Audio Selector 2"]
+                    }
+                },
+                "VideoSelector": {},
+                "TimecodeSource": "ZEROBASED",
+                "FileInput": ""
+            }
+        ]
+    },
+    "AccelerationSettings": {
+        "Mode": "DISABLED"
+    },
+    "StatusUpdateInterval": "SECONDS_60",
+    "Priority": 0
+}
+
+# Decoding the pre-serialized template is a cheaper fresh copy than rebuilding the dict literal
+JOB_SETTINGS_TEMPLATE_JSON = json.dumps(JOB_SETTINGS_TEMPLATE, separators=COMPACT_SEPARATORS)
+
+# Clients are created once per container and reused across warm invocations. They share
+# one session, so credentials and endpoint data are resolved once rather than per client
+session = boto3.session.Session()
+s3_client = session.client('s3')
+polly_client = session.client('polly')
+sts_client = session.client('sts')
+states_client = session.client('stepfunctions')
+
+@lru_cache(maxsize=1)
 def get_mediaconvert_endpoint():
     """Get MediaConvert endpoint for the current region"""
+    # The account endpoint never changes, so describe_endpoints runs once per container
+    endpoint_url = os.environ.get('MEDIACONVERT_ENDPOINT')
+    if endpoint_url:
+        return endpoint_url
     try:
-        mediaconvert_client = boto3.client('mediaconvert')
+        mediaconvert_client = session.client('mediaconvert')
         response = mediaconvert_client.describe_endpoints()
         return response['Endpoints'][0]['Url']
     except Exception as e:
         logger.error(f"Error getting MediaConvert endpoint: {str(e)}")
         raise
 
-def verify_file_exists(s3_client, bucket, key):
+@lru_cache(maxsize=1)
+def get_mediaconvert_client():
+    return session.client('mediaconvert', endpoint_url=get_mediaconvert_endpoint())
+
+# Taken from the invoked function's ARN on the first invocation; STS is only the fallback
+account_id = None
+
+def get_account_id():
+    global account_id
+    if account_id is None:
+        account_id = sts_client.get_caller_identity()['Account']
+    return account_id
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first request doesn't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# Runs during the init phase, once per container
+warm_client(s3_client, 'ListObjectsV2', 'GetObject', 'PutObject')
+warm_client(polly_client, 'StartSpeechSynthesisTask', 'GetSpeechSynthesisTask')
+warm_client(states_client, 'SendTaskSuccess', 'SendTaskFailure')
+try:
+    # Resolving the endpoint here keeps describe_endpoints (rate limited) off the request path
+    warm_client(get_mediaconvert_client(), 'CreateJob')
+except Exception as e:
+    # lru_cache doesn't store failures, so the first job submission retries the lookup
+    logger.warning(f"Deferring MediaConvert client setup: {str(e)}")
+
+def find_video_key(s3_client, bucket, story_id, video_key):
     """
-    Verify that a file exists in S3
+    Return whichever of video_key or its story_id-prefixed alternative exists, or None.
+    A single listing of the story's folder answers for both paths.
     """
+    prefix = f"{story_id}/"
+    alternative_key = f"{prefix}{video_key}"
+    
     try:
-        s3_client.head_object(Bucket=bucket, Key=key)
-        return True
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1000)
     except Exception as e:
-        logger.error(f"File not found - Bucket: {bucket}, Key: {key}, Error: {str(e)}")
-        return False
+        logger.error(f"Error listing s3://{bucket}/{prefix}: {str(e)}")
+        return None
+    keys = {obj['Key'] for obj in response.get('Contents', [])}
+    
+    if video_key in keys or alternative_key in keys:
+        return video_key if video_key in keys else alternative_key
+    if not video_key.startswith(prefix):
+        # The listing can't see a key outside the story folder; MediaConvert's input check is the judge of it
+        logger.info(f"Video key is outside s3://{bucket}/{prefix}; using it unverified")
+        return video_key
+    return None
+
+def backoff_delay(attempt, base_delay=2, max_delay=30, jitter=1):
+    """Exponential delay before the next status check, with jitter so concurrent pollers spread out"""
+    return min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
 
 def get_job_settings():
     """Return MediaConvert job settings with audio mixing"""
-    sts_client = boto3.client('sts')
-    account_id = sts_client.get_caller_identity()['Account']
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    
-    return {
-        "Queue": f"arn:aws:mediaconvert:{region}:{account_id}:queues/Default",
-        "UserMetadata": {},
-        "Role": os.environ['MEDIACONVERT_ROLE_ARN'],
-        "Settings": {
-            "TimecodeConfig": {
-                "Source": "ZEROBASED"
-            },
-            "OutputGroups": [
-                {
-                    "CustomName": "output",
-                    "Name": "File Group",
-                    "Outputs": [
-                        {
-                            "ContainerSettings": {
-                                "Container": "MP4",
-                                "Mp4Settings": {}
-                            },
-                            "VideoDescription": {
-                                "CodecSettings": {
-                                    "Codec": "H_264",
-                                    "H264Settings": {
-                                        "MaxBitrate": 5000000,
-                                        "RateControlMode": "QVBR",
-                                        "SceneChangeDetect": "TRANSITION_DETECTION"
-                                    }
-                                }
-                            },
-                            "AudioDescriptions": [
-                                {
-                                    "AudioSourceName": "Audio Selector 2",
-                                    "AudioNormalizationSettings": {
-                                        "Algorithm": "ITU_BS_1770_3",
-                                        "AlgorithmControl": "CORRECT_AUDIO",
-                                        "TargetLkfs": -23
-                                    },
-                                    "CodecSettings": {
-                                        "Codec": "AAC",
-                                        "AacSettings": {
-                                            "Bitrate": 96000,
-                                            "CodingMode": "CODING_MODE_2_0",
-                                            "SampleRate": 48000
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    "OutputGroupSettings": {
-                        "Type": "FILE_GROUP_SETTINGS",
-                        "FileGroupSettings": {
-                            "Destination": "",
-                            "DestinationSettings": {
-                                "S3Settings": {
-                                    "StorageClass": "STANDARD"
-                                }
-                            }
-                        }
-                    }
-                }
-            ],
-            "Inputs": []
-        },
-        "AccelerationSettings": {
-            "Mode": "DISABLED"
-        },
-        "StatusUpdateInterval": "SECONDS_60",
-        "Priority": 0
-    }
+    job_settings = json.loads(JOB_SETTINGS_TEMPLATE_JSON)
+    job_settings['Queue'] = f"arn:aws:mediaconvert:{REGION}:{get_account_id()}:queues/Default"
+    return job_settings
 
-def get_polly_output_file(s3_client, bucket, prefix, task_id, max_attempts=60, delay=10):
+def get_polly_output_file(s3_client, bucket, prefix, task_id, max_attempts=23, base_delay=2, max_delay=30):
     """Wait for and return the actual Polly output file path"""
     logger.info(f"Waiting for Polly file in bucket: {bucket}, prefix: {prefix}, task_id: {task_id}")
     
     for attempt in range(max_attempts):
+        delay = backoff_delay(attempt, base_delay, max_delay)
         try:
             # Check Polly task status
-            polly_client = boto3.client('polly')
             task_status = polly_client.get_speech_synthesis_task(TaskId=task_id)
             task_state = task_status['SynthesisTask']['TaskStatus']
             
@@ -131,7 +228,7 @@ def get_polly_output_file(s3_client, bucket, prefix, task_id, max_attempts=60, d
                 raise Exception(f"Polly task failed: {error_message}")
             
             elif task_state == 'scheduled' or task_state == 'inProgress':
-                logger.info(f"Polly task still processing. Waiting {delay} seconds...")
+                logger.info(f"Polly task still processing. Waiting {delay:.1f} seconds...")
                 time.sleep(delay)
                 continue
             
@@ -144,268 +241,372 @@ def get_polly_output_file(s3_client, bucket, prefix, task_id, max_attempts=60, d
     
     raise Exception(f"Timeout waiting for Polly file after {max_attempts} attempts")
 
-def wait_for_mediaconvert_job(mediaconvert_client, job_id, max_attempts=30, delay=10):
-    """Wait for MediaConvert job to complete"""
-    logger.info(f"Waiting for MediaConvert job {job_id} to complete")
+def start_narration(story_id, polly_input, destination_bucket, merge_context=None):
+    """
+    Start the Polly synthesis task and return its task ID and output key.
+    The merge context is stored next to the audio; when the narration topic
+    is configured, Polly publishes its result there and the merge resumes
+    from that notification instead of being polled.
+    """
+    logger.info(f"Starting Polly synthesis for story_id: {story_id}")
     
-    for attempt in range(max_attempts):
-        try:
-            response = mediaconvert_client.get_job(Id=job_id)
-            status = response['Job']['Status']
-            
-            logger.info(f"MediaConvert job status (Attempt {attempt + 1}/{max_attempts}): {status}")
-            
-            if status == 'COMPLETE':
-                logger.info("MediaConvert job completed successfully")
-                return True, None
-            elif status in ['ERROR', 'CANCELED']:
-                error_message = response['Job'].get('ErrorMessage', 'Unknown error')
-                logger.error(f"MediaConvert job failed: {error_message}")
-                return False, error_message
-            
-            logger.info(f"Waiting {delay} seconds before next check...")
-            time.sleep(delay)
-            
-        except Exception as e:
-            logger.error(f"Error checking MediaConvert job: {str(e)}")
-            if attempt == max_attempts - 1:
-                return False, str(e)
-            time.sleep(delay)
+    timestamp = int(time.time())
+    audio_prefix = f"{story_id}/audio/speech_{timestamp}"
+    
+    notification = {}
+    if merge_context:
+        # Stored before the task starts so the notification can never arrive first
+        s3_client.put_object(
+            Bucket=destination_bucket,
+            Key=f"{audio_prefix}.json",
+            Body=json.dumps(merge_context, separators=COMPACT_SEPARATORS),
+            ContentType='application/json'
+        )
+        if NARRATION_TOPIC_ARN:
+            notification['SnsTopicArn'] = NARRATION_TOPIC_ARN
+    
+    polly_response = polly_client.start_speech_synthesis_task(
+        Engine='neural',
+        LanguageCode='en-US',
+        OutputFormat='mp3',
+        OutputS3BucketName=destination_bucket,
+        OutputS3KeyPrefix=audio_prefix,
+        Text=polly_input,
+        VoiceId='Ruth',
+        SampleRate='24000',
+        TextType='text',
+        **notification
+    )
     
-    return False, "Timeout waiting for MediaConvert job"
+    task_id = polly_response['SynthesisTask']['TaskId']
+    logger.info(f"Polly task started with ID: {task_id}")
+    # Polly always writes <prefix>.<task id>.<format>
+    return task_id, f"{audio_prefix}.{task_id}.mp3"
 
-def lambda_handler(event, context):
+def merge_audio_video(story_id, video_bucket, video_key, audio_bucket, audio_key, task_id, report_to_task=False):
+    """Submit the MediaConvert job that lays the narration over the video"""
+    mediaconvert_client = get_mediaconvert_client()
+    
     try:
-        # Initialize AWS clients
-        s3_client = boto3.client('s3')
-        polly_client = boto3.client('polly')
+        job_settings = get_job_settings()
         
-        # Get MediaConvert endpoint
-        endpoint_url = os.environ.get('MEDIACONVERT_ENDPOINT')
-        if not endpoint_url:
-            endpoint_url = get_mediaconvert_endpoint()
+        video_input = f"s3://{video_bucket}/{video_key}"
+        audio_input = f"s3://{audio_bucket}/{audio_key}"
         
-        mediaconvert_client = boto3.client('mediaconvert', endpoint_url=endpoint_url)
+        # The input skeleton comes from the template; only the two URIs change per job
+        job_input = job_settings['Settings']['Inputs'][0]
+        job_input['FileInput'] = video_input
+        job_input['AudioSelectors']['Audio Selector 2']['ExternalAudioFileInput'] = audio_input
+        logger.info("MediaConvert inputs: video %s, audio %s", video_input, audio_input)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("MediaConvert input configuration: %s", json.dumps(job_input, separators=COMPACT_SEPARATORS))
         
-        # Get input parameters
-        story_id = event.get('story_id')
-        polly_input = event.get('polly_input')
-        video_path = event.get('video_path')
+        # Set output location
+        output_key = f"{story_id}/final/final_output.mp4"
+        job_settings['Settings']['OutputGroups'][0]['OutputGroupSettings']['FileGroupSettings']['Destination'] = \
+            f"s3://{audio_bucket}/{output_key}"
         
-        if not story_id or not polly_input or not video_path:
-            return {
-                'statusCode': 400,
-                'body': {
-                    'message': 'Missing required parameters. story_id, polly_input, and video_path are required.',
-                    'story_id': story_id
-                }
-            }
+        # Carried on the job's state change events, which finish the merge in handle_job_state_change
+        job_settings['UserMetadata'] = {
+            'story_id': story_id,
+            'polly_task_id': task_id,
+            'video_path': video_input,
+            'audio_path': audio_input
+        }
+        if report_to_task:
+            # The task token itself is too long for UserMetadata; it stays in the narration context
+            job_settings['UserMetadata']['callback'] = 'task_token'
         
-        # Parse video path and handle Nova Reel's output path structure
-        video_path = video_path.replace('s3://', '')
-        video_bucket = video_path.split('/')[0]
+        logger.info(f"Creating MediaConvert job for story_id: {story_id}")
         
-        # Check if the path contains story_id
-        path_parts = video_path.split('/')
-        if len(path_parts) > 3:  # If path includes story_id
-            video_key = '/'.join(path_parts[1:])  # Include story_id in the path
-        else:
-            video_key = '/'.join(path_parts[1:])
+        mediaconvert_response = mediaconvert_client.create_job(**job_settings)
+        job_id = mediaconvert_response['Job']['Id']
+        
+        return {
+            'statusCode': 202,
+            'body': {
+                'message': 'MediaConvert job submitted; the output is verified when the job completes',
+                'mediaconvert_job_id': job_id,
+                'polly_task_id': task_id,
+                'story_id': story_id,
+                'output_path': f"s3://{audio_bucket}/{output_key}"
+            }
+        }
+        
+    except ClientError as e:
+        error_message = str(e)
+        logger.error(f"MediaConvert error: {error_message}")
+        return {
+            'statusCode': 500,
+            'body': {
+                'message': f"Error in MediaConvert job creation: {error_message}",
+                'story_id': story_id,
+                'polly_task_id': task_id
+            }
+        }
 
-        logger.info(f"Parsed video path - Bucket: {video_bucket}, Key: {video_key}")
+def load_merge_context(bucket, audio_key):
+    """Read the context start_narration stored next to the audio"""
+    # Polly names the file <prefix>.<task id>.mp3, and the context was stored at <prefix>.json
+    audio_prefix = audio_key.rsplit('.', 2)[0]
+    context_object = s3_client.get_object(Bucket=bucket, Key=f"{audio_prefix}.json")
+    return json.loads(context_object['Body'].read())
 
-        # Verify video file exists
-        if not verify_file_exists(s3_client, video_bucket, video_key):
-            # Try alternative path with story_id
-            alternative_key = f"{story_id}/{video_key}"
-            logger.info(f"Trying alternative path: {alternative_key}")
-            
-            if verify_file_exists(s3_client, video_bucket, alternative_key):
-                video_key = alternative_key
-                logger.info(f"Found video at alternative path")
-            else:
-                return {
-                    'statusCode': 500,
-                    'body': {
-                        'message': f'Input video file not found at either path: \n1. s3://{video_bucket}/{video_key}\n2. s3://{video_bucket}/{alternative_key}',
-                        'story_id': story_id
-                    }
-                }
-        
-        source_bucket = os.environ['SOURCE_BUCKET']
-        destination_bucket = os.environ['DESTINATION_BUCKET']
+def send_task_result(task_token, result):
+    """Complete the Step Functions task waiting on this merge with its result"""
+    if result['statusCode'] < 400:
+        states_client.send_task_success(taskToken=task_token, output=json.dumps(result['body'], separators=COMPACT_SEPARATORS))
+    else:
+        states_client.send_task_failure(
+            taskToken=task_token,
+            error='AudioVideoMergeFailed',
+            cause=result['body']['message']
+        )
+
+def handle_job_state_change(event):
+    """Verify the merged output when MediaConvert reports a COMPLETE or ERROR job state change"""
+    result = check_merge_output(event['detail'])
+    
+    job_metadata = event['detail'].get('userMetadata', {})
+    if job_metadata.get('callback') == 'task_token':
+        audio_bucket, audio_key = job_metadata['audio_path'].replace('s3://', '').split('/', 1)
+        send_task_result(load_merge_context(audio_bucket, audio_key)['task_token'], result)
+    
+    return result
+
+def check_merge_output(detail):
+    """Build the merge result for a finished MediaConvert job"""
+    job_id = detail['jobId']
+    job_metadata = detail.get('userMetadata', {})
+    story_id = job_metadata.get('story_id')
+    
+    logger.info(f"MediaConvert job {job_id} for story_id {story_id}: {detail['status']}")
+    
+    if detail['status'] != 'COMPLETE':
+        error_message = detail.get('errorMessage', 'Unknown error')
+        logger.error(f"MediaConvert job failed: {error_message}")
+        return {
+            'statusCode': 500,
+            'body': {
+                'message': f"MediaConvert job failed: {error_message}",
+                'story_id': story_id,
+                'job_id': job_id
+            }
+        }
+    
+    # A COMPLETE event lists the files MediaConvert wrote, so the output needs no separate check
+    output_path = detail['outputGroupDetails'][0]['outputDetails'][0]['outputFilePaths'][0]
+    
+    return {
+        'statusCode': 200,
+        'body': {
+            'message': 'Processing completed successfully',
+            'mediaconvert_job_id': job_id,
+            'polly_task_id': job_metadata.get('polly_task_id'),
+            'story_id': story_id,
+            'input_paths': {
+                'video': job_metadata.get('video_path'),
+                'audio': job_metadata.get('audio_path')
+            },
+            'output_path': output_path,
+            'status': {
+                'polly': 'COMPLETED',
+                'mediaconvert': 'COMPLETED'
+            }
+        }
+    }
+
+def handle_narration_notification(event):
+    """Resume the merge for each Polly task result published to the narration topic"""
+    destination_bucket = os.environ['DESTINATION_BUCKET']
+    results = []
+    
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        task_id = message['taskId']
+        # outputUri is path-style (https://s3.<region>.amazonaws.com/<bucket>/<key>)
+        audio_key = urlparse(message['outputUri']).path.split('/', 2)[-1]
+        merge_context = load_merge_context(destination_bucket, audio_key)
+        task_token = merge_context.get('task_token')
         
-        try:
-            logger.info(f"Starting Polly synthesis for story_id: {story_id}")
-            
-            timestamp = int(time.time())
-            audio_prefix = f"{story_id}/audio/speech_{timestamp}"
-            
-            polly_response = polly_client.start_speech_synthesis_task(
-                Engine='neural',
-                LanguageCode='en-US',
-                OutputFormat='mp3',
-                OutputS3BucketName=destination_bucket,
-                OutputS3KeyPrefix=audio_prefix,
-                Text=polly_input,
-                VoiceId='Ruth',
-                SampleRate='24000',
-                TextType='text'
-            )
-            
-            task_id = polly_response['SynthesisTask']['TaskId']
-            logger.info(f"Polly task started with ID: {task_id}")
-            
-            actual_audio_key = get_polly_output_file(
-                s3_client, 
-                destination_bucket, 
-                f"{story_id}/audio/",
+        if message['taskStatus'].lower() != 'completed':
+            logger.error(f"Polly task {task_id} failed: {message.get('taskStatusReason', 'Unknown error')}")
+            result = {
+                'statusCode': 500,
+                'body': {
+                    'message': 'Polly task failed',
+                    'story_id': merge_context['story_id'],
+                    'polly_task_id': task_id
+                }
+            }
+        else:
+            logger.info(f"Found Polly output file: {audio_key}")
+            result = merge_audio_video(
+                merge_context['story_id'],
+                merge_context['video_bucket'],
+                merge_context['video_key'],
+                destination_bucket,
+                audio_key,
                 task_id,
-                max_attempts=60,
-                delay=10
+                report_to_task=bool(task_token)
             )
-            
-            if not actual_audio_key:
-                return {
-                    'statusCode': 500,
-                    'body': {
-                        'message': 'Failed to locate Polly output file',
-                        'story_id': story_id,
-                        'polly_task_id': task_id
-                    }
-                }
-            
-            logger.info(f"Found Polly output file: {actual_audio_key}")
-            
-            try:
-                job_settings = get_job_settings()
-                
-                input_config = {
-                    'FileInput': f"s3://{video_bucket}/{video_key}",
-                    'AudioSelectors': {
-                        'Audio Selector 2': {
-                            'ExternalAudioFileInput': f"s3://{destination_bucket}/{actual_audio_key}"
-                        }
-                    }
-                }
-                logger.info(f"MediaConvert input configuration: {json.dumps(input_config)}")
-                
-                job_settings['Settings']['Inputs'] = [{
-                    'AudioSelectors': {
-                        'Audio Selector 1': {
-                            'DefaultSelection': 'DEFAULT',
-                            'SelectorType': 'TRACK',
-                            'Tracks': [1],
-                            'Offset': 0
-                        },
-                        'Audio Selector 2': {
-                            'DefaultSelection': 'DEFAULT',
-                            'ExternalAudioFileInput': f"s3://{destination_bucket}/{actual_audio_key}",
-                            'SelectorType': 'TRACK',
-                            'Tracks': [1],
-                            'Offset': 0,
-                            'ProgramSelection': 1
-                        }
-                    },
-                    'AudioSelectorGroups': {
-                        'Audio Selector Group 1': {
-                            'AudioSelectorNames': ['Audio Selector 2']
-                        }
-                    },
-                    'VideoSelector': {},
-                    'TimecodeSource': 'ZEROBASED',
-                    'FileInput': f"s3://{video_bucket}/{video_key}"
-                }]
-                
-                # Set output location
-                output_key = f"{story_id}/final/final_output.mp4"
-                job_settings['Settings']['OutputGroups'][0]['OutputGroupSettings']['FileGroupSettings']['Destination'] = \
-                    f"s3://{destination_bucket}/{output_key}"
-                
-                logger.info(f"Creating MediaConvert job for story_id: {story_id}")
-                logger.info(f"Using video input: s3://{video_bucket}/{video_key}")
-                
-                mediaconvert_response = mediaconvert_client.create_job(**job_settings)
-                job_id = mediaconvert_response['Job']['Id']
+        
+        # Success is reported once the MediaConvert job finishes; failures end the waiting task now
+        if task_token and result['statusCode'] >= 400:
+            send_task_result(task_token, result)
+        results.append(result)
+    
+    return results[0] if len(results) == 1 else {'statusCode': 200, 'body': results}
 
-                # Wait for MediaConvert job to complete
-                success, error = wait_for_mediaconvert_job(
-                    mediaconvert_client,
-                    job_id,
-                    max_attempts=30,
-                    delay=10
-                )
+def handle_merge_request(event):
+    """Start the narration and merge for a story's video"""
+    # Get input parameters
+    story_id = event.get('story_id')
+    polly_input = event.get('polly_input')
+    video_path = event.get('video_path')
+    # Set when invoked from a Step Functions .waitForTaskToken state
+    task_token = event.get('task_token')
+    
+    if not story_id or not polly_input or not video_path:
+        return {
+            'statusCode': 400,
+            'body': {
+                'message': 'Missing required parameters. story_id, polly_input, and video_path are required.',
+                'story_id': story_id
+            }
+        }
+    
+    # Parse video path and handle Nova Reel's output path structure
+    video_path = video_path.replace('s3://', '')
+    video_bucket = video_path.split('/')[0]
+    
+    # Check if the path contains story_id
+    path_parts = video_path.split('/')
+    if len(path_parts) > 3:  # If path includes story_id
+        video_key = '/'.join(path_parts[1:])  # Include story_id in the path
+    else:
+        video_key = '/'.join(path_parts[1:])
 
-                if not success:
-                    return {
-                        'statusCode': 500,
-                        'body': {
-                            'message': f"MediaConvert job failed: {error}",
-                            'story_id': story_id,
-                            'job_id': job_id
-                        }
-                    }
+    logger.info(f"Parsed video path - Bucket: {video_bucket}, Key: {video_key}")
 
-                # Verify the output file exists
-                if not verify_file_exists(s3_client, destination_bucket, output_key):
-                    return {
-                        'statusCode': 500,
-                        'body': {
-                            'message': 'MediaConvert output file not found',
-                            'story_id': story_id,
-                            'job_id': job_id
-                        }
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'body': {
-                        'message': 'Processing completed successfully',
-                        'mediaconvert_job_id': job_id,
-                        'polly_task_id': task_id,
-                        'story_id': story_id,
-                        'input_paths': {
-                            'video': f"s3://{video_bucket}/{video_key}",
-                            'audio': f"s3://{destination_bucket}/{actual_audio_key}"
-                        },
-                        'output_path': f"s3://{destination_bucket}/{output_key}",
-                        'status': {
-                            'polly': 'COMPLETED',
-                            'mediaconvert': 'COMPLETED'
-                        }
-                    }
+    # Verify video file exists, either at the given path or under the story_id folder
+    found_key = find_video_key(s3_client, video_bucket, story_id, video_key)
+    if not found_key:
+        alternative_key = f"{story_id}/{video_key}"
+        return {
+            'statusCode': 500,
+            'body': {
+                'message': f'Input video file not found at either path: \n1. s3://{video_bucket}/{video_key}\n2. s3://{video_bucket}/{alternative_key}',
+                'story_id': story_id
+            }
+        }
+    if found_key != video_key:
+        logger.info(f"Found video at alternative path: {found_key}")
+    video_key = found_key
+    
+    destination_bucket = os.environ['DESTINATION_BUCKET']
+    
+    try:
+        if NARRATION_TOPIC_ARN:
+            # Return now; the Polly notification invokes this function again to run the merge
+            task_id, audio_key = start_narration(
+                story_id,
+                polly_input,
+                destination_bucket,
+                {
+                    'story_id': story_id,
+                    'video_bucket': video_bucket,
+                    'video_key': video_key,
+                    'task_token': task_token
                 }
-                
-            except ClientError as e:
-                error_message = str(e)
-                logger.error(f"MediaConvert error: {error_message}")
-                return {
-                    'statusCode': 500,
-                    'body': {
-                        'message': f"Error in MediaConvert job creation: {error_message}",
-                        'story_id': story_id,
-                        'polly_task_id': task_id
-                    }
+            )
+            return {
+                'statusCode': 202,
+                'body': {
+                    'message': 'Narration started; the merge runs when Polly completes',
+                    'polly_task_id': task_id,
+                    'story_id': story_id,
+                    'audio_path': f"s3://{destination_bucket}/{audio_key}"
                 }
-                
-        except ClientError as e:
-            error_message = str(e)
-            logger.error(f"Polly error: {error_message}")
+            }
+        
+        task_id, _ = start_narration(
+            story_id,
+            polly_input,
+            destination_bucket,
+            {'task_token': task_token} if task_token else None
+        )
+        
+        actual_audio_key = get_polly_output_file(
+            s3_client, 
+            destination_bucket, 
+            f"{story_id}/audio/",
+            task_id,
+            max_attempts=23
+        )
+        
+        if not actual_audio_key:
             return {
                 'statusCode': 500,
                 'body': {
-                    'message': f"Error in Polly synthesis: {error_message}",
-                    'story_id': story_id
+                    'message': 'Failed to locate Polly output file',
+                    'story_id': story_id,
+                    'polly_task_id': task_id
                 }
             }
+        
+        logger.info(f"Found Polly output file: {actual_audio_key}")
+        
+        return merge_audio_video(
+            story_id,
+            video_bucket,
+            video_key,
+            destination_bucket,
+            actual_audio_key,
+            task_id,
+            report_to_task=bool(task_token)
+        )
+            
+    except ClientError as e:
+        error_message = str(e)
+        logger.error(f"Polly error: {error_message}")
+        return {
+            'statusCode': 500,
+            'body': {
+                'message': f"Error in Polly synthesis: {error_message}",
+                'story_id': story_id
+            }
+        }
+
+def lambda_handler(event, context):
+    global account_id
+    if account_id is None and context is not None:
+        # arn:aws:lambda:<region>:<account>:function:<name>
+        account_id = context.invoked_function_arn.split(':')[4]
+    
+    try:
+        # Polly completion notifications arrive from the narration topic
+        if 'Records' in event:
+            return handle_narration_notification(event)
+        
+        # MediaConvert Job State Change events arrive from an EventBridge rule
+        if event.get('source') == 'aws.mediaconvert':
+            return handle_job_state_change(event)
+        
+        result = handle_merge_request(event)
             
     except Exception as e:
         error_message = str(e)
         logger.error(f"General error: {error_message}")
-        return {
+        result = {
             'statusCode': 500,
             'body': {
                 'message': f"General error: {error_message}",
-                'story_id': story_id if 'story_id' in locals() else None
+                'story_id': event.get('story_id')
             }
         }
+    
+    # A Step Functions .waitForTaskToken state ignores the return value, so failures go to the token
+    if event.get('task_token') and result['statusCode'] >= 400:
+        send_task_result(event['task_token'], result)
+    return result
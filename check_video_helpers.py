@@ -0,0 +1,46 @@
+"""
+Fail when the shared video helpers in story-video-generator.py drift from
+story_video_common.py. The generator is deployed inline in template.yaml, so it
+keeps a copy of the helpers instead of importing them.
+
+Usage: python check_video_helpers.py
+"""
+import difflib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BEGIN_MARK = '# --- shared video helpers: begin ---\n'
+END_MARK = '# --- shared video helpers: end ---\n'
+COMMON = 'story_video_common.py'
+COPIES = ['story-video-generator.py']
+
+
+def shared_section(filename):
+    """Return the lines between the shared-helper markers in a file"""
+    with open(os.path.join(ROOT, filename)) as f:
+        source = f.read()
+    begin = source.find(BEGIN_MARK)
+    end = source.find(END_MARK)
+    if begin < 0 or end < begin:
+        raise ValueError(f"{filename} has no shared video helper markers")
+    return source[begin + len(BEGIN_MARK):end].splitlines(keepends=True)
+
+
+def main():
+    expected = shared_section(COMMON)
+    drifted = False
+    for copy in COPIES:
+        diff = list(difflib.unified_diff(expected, shared_section(copy), COMMON, copy))
+        if diff:
+            drifted = True
+            sys.stdout.writelines(diff)
+    if drifted:
+        print("Shared video helpers have drifted; copy story_video_common.py's section into the file above")
+        return 1
+    print("Shared video helpers are in sync")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,8 @@
 import json
 import boto3
 import base64
-import time
+import io
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
 from datetime import datetime
 import uuid
@@ -15,20 +16,50 @@ BUCKET_NAME = os.environ['BUCKET_NAME']
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 
-# Create the clients
-bedrock = boto3.client(
+# Everything written here is read by code, so skip the whitespace json.dumps adds by default
+COMPACT_SEPARATORS = (',', ':')
+
+# Compiled once per container rather than on every call
+SCENE_PATTERN = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
+SCENE_HEADING_PATTERN = re.compile(r'^.{1,30}:?\s*\n')
+NAME_PATTERN = re.compile(r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)')
+UNSAFE_TOPIC_PATTERN = re.compile(r'[^a-z0-9_]')
+
+# Five scene images plus the metadata and scenes uploads all run at once
+UPLOAD_WORKERS = 8
+
+# Create the clients from one session, so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+
+# The pool covers every concurrent image request. Adaptive retries add client-side rate
+# limiting on 429/503s, so parallel Nova Canvas calls back off together under Bedrock's TPM limits
+bedrock = session.client(
     service_name='bedrock-runtime',
     region_name="us-east-1",
-    config=Config(read_timeout=300)
+    config=Config(
+        read_timeout=300,
+        max_pool_connections=16,
+        retries={'max_attempts': 5, 'mode': 'adaptive'},
+        tcp_keepalive=True
+    )
 )
-s3 = boto3.client('s3')
+s3 = session.client('s3', config=Config(max_pool_connections=16))
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first requests don't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# The image threads all start together, so build their models once here rather than in each thread
+warm_client(bedrock, 'ConverseStream', 'InvokeModel')
+warm_client(s3, 'PutObject')
 
 def sanitize_topic(topic):
     """
     Sanitizes the topic string for use in file names
     """
     sanitized = topic.lower().replace(' ', '_')
-    sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
+    sanitized = UNSAFE_TOPIC_PATTERN.sub('', sanitized)
     return sanitized[:30]
 
 def generate_story_id(topic):
@@ -40,10 +71,36 @@ def generate_story_id(topic):
     unique_id = str(uuid.uuid4())[:6]
     return f"{date_str}_{topic_str}_{unique_id}"
 
-def generate_story_steps(user_input):
+def parse_scenes(story_text, include_last=True):
+    """
+    Splits story text on its scene markers into cleaned scene descriptions, keeping
+    any text before the first marker. Without include_last, the text after the final
+    marker is left out, since a streamed story may still be writing it.
+    """
+    # One pass over the marker spans; each scene is the slice between one marker's end and the next's start
+    bounds = [0]
+    for match in SCENE_PATTERN.finditer(story_text):
+        bounds += [match.start(), match.end()]
+    bounds.append(len(story_text))
+    spans = list(zip(bounds[::2], bounds[1::2]))
+    if not include_last:
+        spans = spans[:-1]
+    
+    scenes = []
+    for start, end in spans:
+        scene = story_text[start:end].strip()
+        if scene:
+            scenes.append(SCENE_HEADING_PATTERN.sub('', scene, count=1).strip())
+    return scenes
+
+def generate_story_steps(user_input, on_scene=None):
     """
-    Generates story scenes using Claude 3 Sonnet through Amazon Bedrock
+    Generates story scenes using Claude 3 Sonnet through Amazon Bedrock.
+    The story is streamed, and on_scene(index, scene, story_text) is called for
+    each scene as soon as it is complete, so its image can start generating
+    while the rest of the story is still being written.
     """
+    scenes = []
     try:
         enhanced_prompt = f"""Create 5 vivid, cinematic scene descriptions for a compelling story about: {user_input}
 
@@ -79,7 +136,7 @@ Scene 5: [brief, visual description]"""
             }
         ]
 
-        response = bedrock.converse(
+        response = bedrock.converse_stream(
             modelId="anthropic.claude-3-sonnet-20240229-v1:0",
             messages=conversation,
             inferenceConfig={
@@ -90,15 +147,31 @@ Scene 5: [brief, visual description]"""
             }
         )
 
-        story_text = response["output"]["message"]["content"][0]["text"]
-        scene_pattern = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
-        raw_scenes = re.split(scene_pattern, story_text)
-        scenes = [scene.strip() for scene in raw_scenes if scene.strip()]
-        scenes = [re.sub(r'^.{1,30}:?\s*\n', '', scene).strip() for scene in scenes]
-        scenes = scenes[:5]
+        story_text = ''
+        for stream_event in response['stream']:
+            if 'contentBlockDelta' not in stream_event:
+                continue
+            delta = stream_event['contentBlockDelta']['delta'].get('text', '')
+            story_text += delta
+            if not on_scene or '\n' not in delta:
+                continue
+            
+            # Only whole lines are parsed, and the last scene in them may still be growing
+            complete_text = story_text[:story_text.rfind('\n')]
+            complete_scenes = parse_scenes(complete_text, include_last=False)[:5]
+            for idx in range(len(scenes), len(complete_scenes)):
+                scenes.append(complete_scenes[idx])
+                on_scene(idx, complete_scenes[idx], complete_text)
+
+        final_scenes = parse_scenes(story_text)[:5]
         
-        while len(scenes) < 5:
-            scenes.append(f"Scene {len(scenes) + 1} about {user_input}")
+        while len(final_scenes) < 5:
+            final_scenes.append(f"Scene {len(final_scenes) + 1} about {user_input}")
+        
+        for idx in range(len(scenes), len(final_scenes)):
+            scenes.append(final_scenes[idx])
+            if on_scene:
+                on_scene(idx, final_scenes[idx], story_text)
             
         return {
             'scenes': scenes,
@@ -107,7 +180,11 @@ Scene 5: [brief, visual description]"""
         
     except Exception as e:
         print(f"Error in generate_story_steps: {str(e)}")
-        default_scenes = [f"Scene {i} about {user_input}" for i in range(1, 6)]
+        # Scenes already handed to on_scene are kept so they match their images
+        default_scenes = scenes + [f"Scene {i} about {user_input}" for i in range(len(scenes) + 1, 6)]
+        for idx in range(len(scenes), len(default_scenes)):
+            if on_scene:
+                on_scene(idx, default_scenes[idx], '\n'.join(default_scenes))
         return {
             'scenes': default_scenes,
             'full_text': '\n'.join(default_scenes)
@@ -115,7 +192,7 @@ Scene 5: [brief, visual description]"""
 
 def image_from_text(text):
     """
-    Generates an image from text using Nova-Canvas model
+    Generates an image from text using Nova-Canvas model and returns the decoded PNG bytes
     """
     body = json.dumps({
         "taskType": "TEXT_IMAGE",
@@ -130,7 +207,7 @@ def image_from_text(text):
             "cfgScale": 8.0,
             "seed": 0
         }
-    })
+    }, separators=COMPACT_SEPARATORS)
 
     response = bedrock.invoke_model(
         body=body,
@@ -140,20 +217,21 @@ def image_from_text(text):
     )
     
     response_body = json.loads(response.get("body").read())
-    return response_body.get("images")[0]
+    # Decoded here so the base64 text and the parsed response are freed as soon as this returns
+    return base64.b64decode(response_body.get("images")[0])
 
-def save_image_to_s3(image_base64, story_id, scene_number):
+def save_image_to_s3(image_data, story_id, scene_number):
     """
-    Saves a base64 encoded image to S3 and returns the URL
+    Saves PNG image bytes to S3 and returns the URL
     """
     try:
-        image_data = base64.b64decode(image_base64)
         key = f"{story_id}/scene_{scene_number}.png"
         
         s3.put_object(
             Bucket=BUCKET_NAME,
             Key=key,
-            Body=image_data,
+            # BytesIO shares the bytes' buffer, giving botocore a stream to read instead of another copy
+            Body=io.BytesIO(image_data),
             ContentType='image/png'
         )
         
@@ -163,34 +241,50 @@ def save_image_to_s3(image_base64, story_id, scene_number):
         print(f"Error saving image to S3: {str(e)}")
         return None
 
-def save_metadata_to_s3(story_id, metadata, scenes):
+def generate_and_upload(scene_context, story_id, scene_number):
+    """
+    Generates the image for one scene and saves it to S3, returning the URL
     """
-    Saves metadata and scene information to S3
+    print(f"Generating image {scene_number}/5")
+    image_data = image_from_text(scene_context)
+    image_url = save_image_to_s3(image_data, story_id, scene_number)
+    if not image_url:
+        raise Exception(f"Failed to save image {scene_number} to S3")
+    return image_url
+
+def save_metadata_to_s3(story_id, metadata, scenes, executor):
+    """
+    Saves metadata and scene information to S3, uploading both files on the given executor
     """
     try:
         metadata['image_resolution'] = {
             'width': TARGET_WIDTH,
             'height': TARGET_HEIGHT
         }
-        
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/metadata.json",
-            Body=json.dumps(metadata),
-            ContentType='application/json'
-        )
 
         scenes_data = {
             f"shot{i+1}_text": scene
             for i, scene in enumerate(scenes)
         }
 
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/scenes.json",
-            Body=json.dumps(scenes_data, indent=2),
-            ContentType='application/json'
-        )
+        uploads = [
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/metadata.json",
+                Body=json.dumps(metadata, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            ),
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/scenes.json",
+                Body=json.dumps(scenes_data, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            )
+        ]
+        for upload in uploads:
+            upload.result()
         
         return True
     except Exception as e:
@@ -202,35 +296,34 @@ def extract_character_details(story_text):
     Extracts and tracks character details from the story
     """
     characters = {}
-    name_pattern = r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)'
-    
-    scenes = story_text.split('Scene')
-    for scene in scenes:
-        matches = re.finditer(name_pattern, scene)
+    for scene_idx, scene in enumerate(story_text.split('Scene'), start=1):
+        matches = NAME_PATTERN.finditer(scene)
         for match in matches:
             name = match.group(1)
             if name not in characters:
                 sentence = next((s for s in scene.split('.') if name in s), '')
                 characters[name] = {
                     'first_appearance': sentence,
-                    'scenes_present': [scenes.index(scene) + 1]
+                    'scenes_present': [scene_idx]
                 }
             else:
-                characters[name]['scenes_present'].append(scenes.index(scene) + 1)
+                characters[name]['scenes_present'].append(scene_idx)
     
     return characters
 
-def enhance_scene_description(scene_text, characters):
+def enhance_scene_description(scene_text, char_items):
     """
-    Enhances scene description with consistent character details
+    Enhances scene description with consistent character details.
+    char_items is a list of (name, first_appearance) pairs, built once per story text
     """
-    enhanced_text = scene_text
-    for name, details in characters.items():
-        if any(name in scene_text for name in characters.keys()):
-            character_desc = details['first_appearance']
-            enhanced_text = f"{enhanced_text}\nEnsure {name} appears exactly as: {character_desc}"
-    
-    return enhanced_text
+    extras = [
+        f"Ensure {name} appears exactly as: {character_desc}"
+        for name, character_desc in char_items
+        if name in scene_text
+    ]
+    if not extras:
+        return scene_text
+    return scene_text + '\n' + '\n'.join(extras)
 
 def handler(event, context):
     """
@@ -255,56 +348,50 @@ def handler(event, context):
         story_id = generate_story_id(user_input)
         print(f"Generating story for topic: {user_input}")
         
-        # Get scenes and full text from Claude 3 Sonnet
-        story_data = generate_story_steps(user_input)
-        scenes = story_data['scenes']
-        full_text = story_data['full_text']
-        
-        # Extract character details for consistency
-        characters = extract_character_details(full_text)
-        print(f"Identified characters: {list(characters.keys())}")
-        
         print("Generating images for scenes")
         image_urls = []
         
-        metadata = {
-            'story_id': story_id,
-            'topic': user_input,
-            'creation_date': datetime.now().isoformat(),
-            'scene_count': len(scenes)
-        }
-        
-        # Save metadata and scenes first
-        save_metadata_to_s3(story_id, metadata, scenes)
-        
-        # Generate and save images with character consistency
-        for idx, scene in enumerate(scenes):
-            print(f"Generating image {idx + 1}/5")
+        # Images are independent, so generate them concurrently; Bedrock throttling is left to the client's retries.
+        # The metadata and scenes uploads share the pool and finish while the images are still generating
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = []
+            # Scenes handed over at the end of the stream share one text, so its characters are extracted once
+            char_items_by_text = {}
             
-            enhanced_scene = enhance_scene_description(scene, characters)
-            scene_number = idx + 1
-            scene_context = f"""Scene {scene_number} of 5:
+            def submit_scene(idx, scene, story_text):
+                # Every character in this scene has already appeared, so the text so far holds their first description
+                if story_text not in char_items_by_text:
+                    characters = extract_character_details(story_text)
+                    char_items_by_text[story_text] = [
+                        (name, details['first_appearance']) for name, details in characters.items()
+                    ]
+                enhanced_scene = enhance_scene_description(scene, char_items_by_text[story_text])
+                scene_context = f"""Scene {idx + 1} of 5:
             {enhanced_scene} """
+                futures.append(executor.submit(generate_and_upload, scene_context, story_id, idx + 1))
             
-            if idx > 0:
-                time.sleep(2)
+            # Get scenes and full text from Claude 3 Sonnet, starting each image as its scene is written
+            story_data = generate_story_steps(user_input, on_scene=submit_scene)
+            scenes = story_data['scenes']
+            full_text = story_data['full_text']
             
-            try:
-                image_base64 = image_from_text(scene_context)
-                image_url = save_image_to_s3(
-                    image_base64,
-                    story_id,
-                    scene_number
-                )
-                
-                if image_url:
-                    image_urls.append(image_url)
-                else:
-                    raise Exception(f"Failed to save image {scene_number} to S3")
-                
-            except Exception as img_error:
-                print(f"Error generating image {scene_number}: {str(img_error)}")
-                continue
+            # Extract character details for consistency
+            characters = extract_character_details(full_text)
+            print(f"Identified characters: {list(characters.keys())}")
+            
+            metadata = {
+                'story_id': story_id,
+                'topic': user_input,
+                'creation_date': datetime.now().isoformat(),
+                'scene_count': len(scenes)
+            }
+            
+            save_metadata_to_s3(story_id, metadata, scenes, executor)
+            for scene_number, future in enumerate(futures, start=1):
+                try:
+                    image_urls.append(future.result())
+                except Exception as img_error:
+                    print(f"Error generating image {scene_number}: {str(img_error)}")
 
         # Prepare minimal response data
         response_data = {
@@ -317,7 +404,7 @@ def handler(event, context):
 
         return {
             'statusCode': 200,
-            'body': json.dumps(response_data),
+            'body': json.dumps(response_data, separators=COMPACT_SEPARATORS),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
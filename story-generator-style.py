@@ -2,11 +2,14 @@
 import json
 import boto3
 import base64
-import time
+import hashlib
+import io
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
 from datetime import datetime
-import uuid
 import re
+import string
 import os
 
 # Get bucket name from environment variable
@@ -16,72 +19,158 @@ BUCKET_NAME = os.environ['BUCKET_NAME']
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 
-# Create the clients
-bedrock = boto3.client(
+# Compiled once per container rather than on every call
+SCENE_PATTERN = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
+SCENE_HEADING_PATTERN = re.compile(r'^.{1,30}:?\s*\n')
+NAME_PATTERN = re.compile(r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)')
+
+# Everything written here is read by code, so skip the whitespace json.dumps adds by default
+COMPACT_SEPARATORS = (',', ':')
+
+class FolderNameTable(dict):
+    """str.translate table that deletes every character it has no entry for"""
+    def __missing__(self, key):
+        return None
+
+# Lowercases letters and turns spaces into underscores; anything else outside [a-z0-9_] is dropped
+FOLDER_NAME_TABLE = FolderNameTable(
+    {ord(c): ord(c) for c in string.ascii_lowercase + string.digits + '_'}
+)
+FOLDER_NAME_TABLE.update({ord(c): ord(c.lower()) for c in string.ascii_uppercase})
+FOLDER_NAME_TABLE[ord(' ')] = ord('_')
+
+# Image styles with safe content guidelines, keyed by the request's style name
+STYLES = {
+    "cartoon": {
+        "prompt": "A family-friendly cartoon style image with cheerful colors and clean lines. ",
+        "negative": "realistic, photograph, inappropriate content, unsafe elements"
+    },
+    "realistic": {
+        "prompt": "A photorealistic image with natural lighting and detailed textures. ",
+        "negative": "cartoon, inappropriate content, unsafe elements"
+    },
+    "anime": {
+        "prompt": "An anime-style illustration with distinctive anime characteristics. ",
+        "negative": "realistic, western animation, photograph, 3D rendering"
+    },
+    "watercolor": {
+        "prompt": "A soft watercolor painting with gentle brush strokes and flowing colors. ",
+        "negative": "sharp edges, harsh lines, digital art, photograph"
+    },
+    "3d_render": {
+        "prompt": "A 3D rendered scene with smooth surfaces and dramatic lighting. ",
+        "negative": "2D, flat, hand-drawn, sketch, painting"
+    }
+}
+
+# Safety terms added to every style's negative prompt
+SAFETY_NEGATIVE = (
+    "inappropriate content, offensive content, disturbing elements, violent content, "
+    "unsafe content, graphic content, adult content, blurry, distorted, melting, "
+    "overlapping elements, inconsistent appearances"
+)
+NEGATIVE_PROMPTS = {
+    name: f"{style['negative']}, {SAFETY_NEGATIVE}"
+    for name, style in STYLES.items()
+}
+
+# Words stripped from prompts to avoid content filter issues
+FORBIDDEN_WORDS = [
+    'violent', 'nude', 'naked', 'blood', 'gore', 'explicit',
+    'inappropriate', 'offensive', 'disturbing', 'graphic',
+    'death', 'kill', 'weapon', 'gun', 'nsfw', 'adult'
+]
+# Whole words only, so "skill" or "begun" aren't mangled, and the prompt keeps its casing
+FORBIDDEN_PATTERN = re.compile(r'\b(?:' + '|'.join(map(re.escape, FORBIDDEN_WORDS)) + r')\b', re.IGNORECASE)
+
+# Static scene-writing instructions; only the story topic is sent per request
+SCENE_SYSTEM_PROMPT = """Create 5 family-friendly, safe-for-all-ages scene descriptions for a story about the given topic.
+
+Please make each scene:
+- Appropriate for all audiences
+- Wholesome and positive
+- Rich with safe, appropriate sensory details
+- Include consistent characters with these guidelines:
+    * Introduce characters with specific, family-friendly descriptions
+    * Maintain each character's exact appearance throughout all scenes
+    * Use the same names and descriptions for recurring characters
+    * Keep character relationships and dynamics appropriate and positive
+- Set in clear, well-defined locations
+- Ensure clear separation between characters and background elements
+- Each scene should be 2-3 sentences maximum
+- Focus on positive visual elements and actions
+- Clear, specific descriptions
+- Avoid any controversial or sensitive topics
+- Each scene description must be under 10 words
+
+Format:
+Scene 1: [brief, visual description]
+Scene 2: [brief, visual description]
+Scene 3: [brief, visual description]
+Scene 4: [brief, visual description]
+Scene 5: [brief, visual description]"""
+
+# Generated images are cached under this prefix, keyed by the SHA-256 of the request body.
+# Nothing here deletes entries: give the bucket a lifecycle rule expiring objects under
+# imgcache/ (for example after 30 days) so the cache doesn't grow without bound
+IMAGE_CACHE_PREFIX = "imgcache/"
+
+# Five scene images plus the metadata and scenes uploads all run at once
+UPLOAD_WORKERS = 8
+
+# Create the clients from one session, so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+
+# The pool covers every concurrent image request and upload. Adaptive retries back off
+# on Bedrock throttling now that the scene images are requested together
+bedrock = session.client(
     service_name='bedrock-runtime',
     region_name="us-east-1",
-    config=Config(read_timeout=300)
+    config=Config(
+        read_timeout=300,
+        max_pool_connections=16,
+        retries={'mode': 'adaptive', 'max_attempts': 5},
+        tcp_keepalive=True
+    )
 )
-s3 = boto3.client('s3')
+s3 = session.client('s3', config=Config(max_pool_connections=16))
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first requests don't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# The image threads all start together, so build their models once here rather than in each thread
+warm_client(bedrock, 'Converse', 'InvokeModel')
+warm_client(s3, 'HeadObject', 'CopyObject', 'PutObject')
+# botocore builds a client's exception classes on first access; resolve the one the image
+# threads catch here, at init, instead of racing to build it from several threads at once
+VALIDATION_EXCEPTION = bedrock.exceptions.ValidationException
 
 def get_image_style(style_name):
     """
     Returns the style prompt based on the selected style with safe content guidelines
     """
-    styles = {
-        "cartoon": {
-            "prompt": "A family-friendly cartoon style image with cheerful colors and clean lines. ",
-            "negative": "realistic, photograph, inappropriate content, unsafe elements"
-        },
-        "realistic": {
-            "prompt": "A photorealistic image with natural lighting and detailed textures. ",
-            "negative": "cartoon, inappropriate content, unsafe elements"
-        },
-        "anime": {
-            "prompt": "An anime-style illustration with distinctive anime characteristics. ",
-            "negative": "realistic, western animation, photograph, 3D rendering"
-        },
-        "watercolor": {
-            "prompt": "A soft watercolor painting with gentle brush strokes and flowing colors. ",
-            "negative": "sharp edges, harsh lines, digital art, photograph"
-        },
-        "3d_render": {
-            "prompt": "A 3D rendered scene with smooth surfaces and dramatic lighting. ",
-            "negative": "2D, flat, hand-drawn, sketch, painting"
-        }
-    }
-    
-    return styles.get(style_name, styles["realistic"])
+    return STYLES.get(style_name, STYLES["realistic"])
 
+@lru_cache(maxsize=256)
 def sanitize_folder_name(topic):
     """
     Sanitizes the topic string for use in folder names while preserving original meaning
     """
-    # Convert to lowercase and replace spaces with underscores
-    sanitized = topic.lower().replace(' ', '_')
-    # Remove any characters that aren't alphanumeric or underscores
-    sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
+    # Lowercase, replace spaces with underscores and drop anything else in one pass
+    sanitized = topic.translate(FOLDER_NAME_TABLE)
     # Limit length to prevent extremely long folder names
     return sanitized[:50]
 
+@lru_cache(maxsize=256)
 def sanitize_prompt(text):
     """
     Sanitizes prompt text to avoid content filter issues
     """
-    text = text.lower()
-    
-    forbidden_words = [
-        'violent', 'nude', 'naked', 'blood', 'gore', 'explicit',
-        'inappropriate', 'offensive', 'disturbing', 'graphic',
-        'death', 'kill', 'weapon', 'gun', 'nsfw', 'adult'
-    ]
-    
-    for word in forbidden_words:
-        text = text.replace(word, '')
-    
     safe_context = "safe for all audiences, family friendly, "
     
-    return safe_context + text
+    return safe_context + FORBIDDEN_PATTERN.sub('', text)
 
 def generate_story_id(topic):
     """
@@ -89,7 +178,7 @@ def generate_story_id(topic):
     """
     date_str = datetime.now().strftime('%Y%m%d')
     topic_str = sanitize_folder_name(topic)  # Use original topic for folder name
-    unique_id = str(uuid.uuid4())[:6]
+    unique_id = os.urandom(3).hex()
     return f"{date_str}_{topic_str}_{unique_id}"
 
 def generate_story_steps(user_input):
@@ -98,44 +187,19 @@ def generate_story_steps(user_input):
     """
     try:
         safe_input = sanitize_prompt(user_input)
-        enhanced_prompt = f"""Create 5 family-friendly, safe-for-all-ages scene descriptions for a story about: {safe_input}
-
-Please make each scene:
-- Appropriate for all audiences
-- Wholesome and positive
-- Rich with safe, appropriate sensory details
-- Include consistent characters with these guidelines:
-    * Introduce characters with specific, family-friendly descriptions
-    * Maintain each character's exact appearance throughout all scenes
-    * Use the same names and descriptions for recurring characters
-    * Keep character relationships and dynamics appropriate and positive
-- Set in clear, well-defined locations
-- Ensure clear separation between characters and background elements
-- Each scene should be 2-3 sentences maximum
-- Focus on positive visual elements and actions
-- Clear, specific descriptions
-- Avoid any controversial or sensitive topics
-- Each scene description must be under 10 words
-
-Format:
-Scene 1: [brief, visual description]
-Scene 2: [brief, visual description]
-Scene 3: [brief, visual description]
-Scene 4: [brief, visual description]
-Scene 5: [brief, visual description]"""
-
         conversation = [
             {
                 "role": "user",
-                "content": [{"text": enhanced_prompt}],
+                "content": [{"text": f"Story topic: {safe_input}"}],
             }
         ]
 
         response = bedrock.converse(
             modelId="anthropic.claude-3-sonnet-20240229-v1:0",
+            system=[{"text": SCENE_SYSTEM_PROMPT}],
             messages=conversation,
             inferenceConfig={
-                "maxTokens": 300,
+                "maxTokens": 600,
                 "temperature": 0.7,
                 "topP": 0.9,
                 "stopSequences": ["Scene 6"]
@@ -143,11 +207,14 @@ Scene 5: [brief, visual description]"""
         )
 
         story_text = response["output"]["message"]["content"][0]["text"]
-        scene_pattern = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
-        raw_scenes = re.split(scene_pattern, story_text)
-        scenes = [scene.strip() for scene in raw_scenes if scene.strip()]
-        scenes = [re.sub(r'^.{1,30}:?\s*\n', '', scene).strip() for scene in scenes]
-        scenes = scenes[:5]
+        # Strip each chunk once and stop at the fifth scene instead of cleaning text that gets discarded
+        scenes = []
+        for raw_scene in SCENE_PATTERN.split(story_text):
+            scene = raw_scene.strip()
+            if scene:
+                scenes.append(SCENE_HEADING_PATTERN.sub('', scene, count=1).strip())
+                if len(scenes) == 5:
+                    break
         
         while len(scenes) < 5:
             scenes.append(f"Scene {len(scenes) + 1} about {safe_input}")
@@ -165,9 +232,44 @@ Scene 5: [brief, visual description]"""
             'full_text': '\n'.join(default_scenes)
         }
 
+def image_cache_key(body):
+    """
+    Returns the cache key for a Nova-Canvas request body
+    """
+    return f"{IMAGE_CACHE_PREFIX}{hashlib.sha256(body.encode()).hexdigest()}.png"
+
+def is_image_cached(key):
+    """
+    Checks whether a cached image exists, without downloading it
+    """
+    try:
+        s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except Exception as e:
+        # head_object reports a missing key as a bare 404 ClientError, or as 403 without
+        # s3:ListBucket; either way it's a miss
+        print(f"Image cache miss for {key}: {str(e)}")
+        return False
+
+def store_cached_image(key, image_data):
+    """
+    Stores a generated image under its cache key; failures only skip the cache
+    """
+    try:
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            Body=io.BytesIO(image_data),
+            ContentType='image/png'
+        )
+    except Exception as e:
+        print(f"Error caching image: {str(e)}")
+
 def image_from_text(text, style_name="realistic"):
     """
-    Generates an image from text using Nova-Canvas model with specified style
+    Generates an image from text using Nova-Canvas model with specified style and returns
+    (PNG bytes, None), or (None, cache key) when an identical request was generated before
+    so the caller can copy it inside S3
     """
     try:
         style_config = get_image_style(style_name)
@@ -178,26 +280,11 @@ def image_from_text(text, style_name="realistic"):
         # Add safety guarantees to the prompt
         safe_prompt = f"""{style_config['prompt']}{sanitized_text}"""
         
-        # Enhanced negative prompts
-        enhanced_negative = f"""
-        {style_config['negative']}, 
-        inappropriate content,
-        offensive content,
-        disturbing elements,
-        violent content,
-        unsafe content,
-        graphic content,
-        adult content,
-        blurry, distorted, melting, 
-        overlapping elements, 
-        inconsistent appearances
-        """
-
-        body = json.dumps({
+        params = {
             "taskType": "TEXT_IMAGE",
             "textToImageParams": {
                 "text": safe_prompt,
-                "negativeText": enhanced_negative
+                "negativeText": NEGATIVE_PROMPTS.get(style_name, NEGATIVE_PROMPTS["realistic"])
             },
             "imageGenerationConfig": {
                 "numberOfImages": 1,
@@ -206,14 +293,22 @@ def image_from_text(text, style_name="realistic"):
                 "cfgScale": 7.0,
                 "seed": 0
             }
-        })
+        }
+        body = json.dumps(params, separators=COMPACT_SEPARATORS)
 
         # Add retry logic
         max_retries = 3
         retry_count = 0
         
-        while retry_count < max_retries:
+        # Every pass either returns the image or, on the last attempt, re-raises
+        while True:
             try:
+                # The seed is fixed, so an identical body always yields the same image
+                cache_key = image_cache_key(body)
+                if is_image_cached(cache_key):
+                    print("Using cached image")
+                    return None, cache_key
+
                 response = bedrock.invoke_model(
                     body=body,
                     modelId="amazon.nova-canvas-v1:0",
@@ -222,55 +317,38 @@ def image_from_text(text, style_name="realistic"):
                 )
                 
                 response_body = json.loads(response.get("body").read())
-                return response_body.get("images")[0]
+                image_data = base64.b64decode(response_body.get("images")[0])
+                store_cached_image(cache_key, image_data)
+                return image_data, None
                 
-            except Exception as e:
-                if "ValidationException" in str(e) and retry_count < max_retries - 1:
-                    retry_count += 1
-                    print(f"Attempt {retry_count} failed, retrying with more sanitized prompt...")
-                    
-                    # Further sanitize the prompt on retry
-                    sanitized_text = sanitize_prompt(sanitized_text)
-                    safe_prompt = f"{style_config['prompt']}{sanitized_text}"
-                    
-                    body = json.dumps({
-                        "taskType": "TEXT_IMAGE",
-                        "textToImageParams": {
-                            "text": safe_prompt,
-                            "negativeText": enhanced_negative
-                        },
-                        "imageGenerationConfig": {
-                            "numberOfImages": 1,
-                            "width": TARGET_WIDTH,
-                            "height": TARGET_HEIGHT,
-                            "cfgScale": 6.0,
-                            "seed": retry_count
-                        }
-                    })
-                    
-                    time.sleep(2)
-                    continue
-                else:
-                    raise e
-                    
-        raise Exception("Max retries reached for image generation")
+            except VALIDATION_EXCEPTION:
+                # Throttling and transient errors are retried with backoff by the client itself;
+                # only a rejected prompt is worth re-sending with different settings
+                if retry_count >= max_retries - 1:
+                    raise
+                retry_count += 1
+                print(f"Attempt {retry_count} failed, retrying with a lower cfgScale and new seed...")
+                
+                # The prompt is already sanitized; running it through again would only repeat the prefix
+                params["imageGenerationConfig"]["cfgScale"] = 6.0
+                params["imageGenerationConfig"]["seed"] = retry_count
+                body = json.dumps(params, separators=COMPACT_SEPARATORS)
         
     except Exception as e:
         print(f"Error in image generation: {str(e)}")
         raise
 
-def save_image_to_s3(image_base64, story_id, scene_number):
+def save_image_to_s3(image_data, story_id, scene_number):
     """
-    Saves a base64 encoded image to S3 and returns the URL
+    Saves PNG image bytes to S3 and returns the URL
     """
     try:
-        image_data = base64.b64decode(image_base64)
         key = f"{story_id}/scene_{scene_number}.png"
         
         s3.put_object(
             Bucket=BUCKET_NAME,
             Key=key,
-            Body=image_data,
+            Body=io.BytesIO(image_data),
             ContentType='image/png'
         )
         
@@ -280,9 +358,40 @@ def save_image_to_s3(image_base64, story_id, scene_number):
         print(f"Error saving image to S3: {str(e)}")
         return None
 
-def save_metadata_to_s3(story_id, metadata, scenes, style_name):
+def copy_cached_image_to_s3(cache_key, story_id, scene_number):
+    """
+    Copies a cached image to the scene's key inside S3 and returns the URL
+    """
+    try:
+        key = f"{story_id}/scene_{scene_number}.png"
+        s3.copy_object(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            CopySource={'Bucket': BUCKET_NAME, 'Key': cache_key}
+        )
+        return f"s3://{BUCKET_NAME}/{key}"
+    except Exception as e:
+        print(f"Error copying cached image in S3: {str(e)}")
+        return None
+
+def generate_and_upload(scene_context, style_name, story_id, scene_number):
+    """
+    Generates the styled image for one scene and saves it to S3, returning the URL
+    """
+    print(f"Generating image {scene_number}/5")
+    image_data, cache_key = image_from_text(scene_context, style_name)
+    if cache_key:
+        # The bytes never leave S3 for a cached image
+        image_url = copy_cached_image_to_s3(cache_key, story_id, scene_number)
+    else:
+        image_url = save_image_to_s3(image_data, story_id, scene_number)
+    if not image_url:
+        raise Exception(f"Failed to save image {scene_number} to S3")
+    return image_url
+
+def save_metadata_to_s3(story_id, metadata, scenes, style_name, executor):
     """
-    Saves metadata and scene information to S3
+    Saves metadata and scene information to S3, uploading both files on the given executor
     """
     try:
         metadata['image_resolution'] = {
@@ -290,25 +399,30 @@ def save_metadata_to_s3(story_id, metadata, scenes, style_name):
             'height': TARGET_HEIGHT
         }
         metadata['style'] = style_name
-        
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/metadata.json",
-            Body=json.dumps(metadata),
-            ContentType='application/json'
-        )
 
         scenes_data = {
             f"shot{i+1}_text": scene
             for i, scene in enumerate(scenes)
         }
 
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/scenes.json",
-            Body=json.dumps(scenes_data, indent=2),
-            ContentType='application/json'
-        )
+        uploads = [
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/metadata.json",
+                Body=json.dumps(metadata, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            ),
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/scenes.json",
+                Body=json.dumps(scenes_data, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            )
+        ]
+        for upload in uploads:
+            upload.result()
         
         return True
     except Exception as e:
@@ -320,21 +434,17 @@ def extract_character_details(story_text):
     Extracts and tracks character details from the story
     """
     characters = {}
-    name_pattern = r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)'
-    
-    scenes = story_text.split('Scene')
-    for scene in scenes:
-        matches = re.finditer(name_pattern, scene)
-        for match in matches:
-            name = match.group(1)
+    for scene_number, scene in enumerate(story_text.split('Scene'), start=1):
+        sentences = scene.split('.')
+        for name in NAME_PATTERN.findall(scene):
             if name not in characters:
-                sentence = next((s for s in scene.split('.') if name in s), '')
+                sentence = next((s for s in sentences if name in s), '')
                 characters[name] = {
                     'first_appearance': sentence.strip(),
-                    'scenes_present': [scenes.index(scene) + 1]
+                    'scenes_present': [scene_number]
                 }
             else:
-                characters[name]['scenes_present'].append(scenes.index(scene) + 1)
+                characters[name]['scenes_present'].append(scene_number)
     
     return characters
 
@@ -342,13 +452,12 @@ def enhance_scene_description(scene_text, characters):
     """
     Enhances scene description with consistent character details
     """
-    enhanced_text = scene_text
+    parts = [scene_text]
     for name, details in characters.items():
-        if any(name in scene_text for name in characters.keys()):
-            character_desc = details['first_appearance']
-            enhanced_text = f"{enhanced_text}\nFeature {name} as: {character_desc}"
+        if name in scene_text:
+            parts.append(f"Feature {name} as: {details['first_appearance']}")
     
-    return enhanced_text
+    return '\n'.join(parts)
 
 def handler(event, context):
     """
@@ -394,37 +503,25 @@ def handler(event, context):
             'scene_count': len(scenes)
         }
         
-        # Save metadata and scenes
-        save_metadata_to_s3(story_id, metadata, scenes, style_name)
+        # Build every image prompt up front so the workers only do Bedrock and S3 I/O
+        scene_contexts = [
+            f"Scene {scene_number} of 5:\n{enhance_scene_description(scene, characters)}"
+            for scene_number, scene in enumerate(scenes, start=1)
+        ]
         
-        # Generate and save images
-        for idx, scene in enumerate(scenes):
-            print(f"Generating image {idx + 1}/5")
-            
-            enhanced_scene = enhance_scene_description(scene, characters)
-            scene_number = idx + 1
-            scene_context = f"""Scene {scene_number} of 5:
-            {enhanced_scene} """
-            
-            if idx > 0:
-                time.sleep(2)
-            
-            try:
-                image_base64 = image_from_text(scene_context, style_name)
-                image_url = save_image_to_s3(
-                    image_base64,
-                    story_id,
-                    scene_number
-                )
-                
-                if image_url:
-                    image_urls.append(image_url)
-                else:
-                    raise Exception(f"Failed to save image {scene_number} to S3")
-                
-            except Exception as img_error:
-                print(f"Error generating image {scene_number}: {str(img_error)}")
-                continue
+        # Images are independent, so generate them concurrently; Bedrock throttling is left to the client's retries.
+        # The metadata and scenes uploads share the pool and finish while the images are still generating
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(generate_and_upload, scene_context, style_name, story_id, scene_number)
+                for scene_number, scene_context in enumerate(scene_contexts, start=1)
+            ]
+            save_metadata_to_s3(story_id, metadata, scenes, style_name, executor)
+            for scene_number, future in enumerate(futures, start=1):
+                try:
+                    image_urls.append(future.result())
+                except Exception as img_error:
+                    print(f"Error generating image {scene_number}: {str(img_error)}")
 
         # Prepare response data
         response_data = {
@@ -438,7 +535,7 @@ def handler(event, context):
 
         return {
             'statusCode': 200,
-            'body': json.dumps(response_data),
+            'body': json.dumps(response_data, separators=COMPACT_SEPARATORS),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
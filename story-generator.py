@@ -1,10 +1,11 @@
 import json
 import boto3
 import base64
-import time
+import io
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from botocore.config import Config
 from datetime import datetime
-import uuid
 import re
 import os
 
@@ -15,20 +16,51 @@ BUCKET_NAME = os.environ['BUCKET_NAME']
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 
-# Create the clients
-bedrock = boto3.client(
+# Everything written here is read by code, so skip the whitespace json.dumps adds by default
+COMPACT_SEPARATORS = (',', ':')
+
+# Compiled once per container rather than on every call
+UNSAFE_TOPIC_PATTERN = re.compile(r'[^a-z0-9_]')
+
+# How long the scene image links returned to the caller stay valid
+IMAGE_URL_EXPIRY_SECONDS = 3600
+
+# Five scene images plus the metadata and scenes uploads all run at once
+UPLOAD_WORKERS = 8
+
+# Create the clients from one session, so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+
+# The pool covers every concurrent image request and upload. Adaptive retries back off
+# on Bedrock throttling now that the scene images are requested together
+bedrock = session.client(
     service_name='bedrock-runtime',
     region_name="us-east-1",
-    config=Config(read_timeout=300)
+    config=Config(
+        read_timeout=300,
+        max_pool_connections=16,
+        retries={'mode': 'adaptive', 'max_attempts': 5},
+        tcp_keepalive=True
+    )
 )
-s3 = boto3.client('s3')
+s3 = session.client('s3', config=Config(max_pool_connections=16))
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first requests don't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
 
+# The image threads all start together, so build their models once here rather than in each thread
+warm_client(bedrock, 'Converse', 'InvokeModel')
+warm_client(s3, 'PutObject', 'GetObject')
+
+@lru_cache(maxsize=256)
 def sanitize_topic(topic):
     """
     Sanitizes the topic string for use in file names
     """
     sanitized = topic.lower().replace(' ', '_')
-    sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
+    sanitized = UNSAFE_TOPIC_PATTERN.sub('', sanitized)
     return sanitized[:30]
 
 def generate_story_id(topic):
@@ -37,7 +69,7 @@ def generate_story_id(topic):
     """
     date_str = datetime.now().strftime('%Y%m%d')
     topic_str = sanitize_topic(topic)
-    unique_id = str(uuid.uuid4())[:6]
+    unique_id = os.urandom(3).hex()
     return f"{date_str}_{topic_str}_{unique_id}"
 
 def generate_story_steps(user_input):
@@ -94,7 +126,7 @@ def generate_story_steps(user_input):
 
 def image_from_text(text):
     """
-    Generates an image from text using Nova-Canvas model
+    Generates an image from text using Nova-Canvas model and returns the decoded PNG bytes
     """
     body = json.dumps({
         "taskType": "TEXT_IMAGE",
@@ -108,7 +140,7 @@ def image_from_text(text):
             "cfgScale": 8.0,
             "seed": 0
         }
-    })
+    }, separators=COMPACT_SEPARATORS)
     
     response = bedrock.invoke_model(
         body=body,
@@ -118,32 +150,44 @@ def image_from_text(text):
     )
     
     response_body = json.loads(response.get("body").read())
-    return response_body.get("images")[0]
+    return base64.b64decode(response_body.get("images")[0])
 
-def save_image_to_s3(image_base64, story_id, scene_number):
+def save_image_to_s3(image_data, story_id, scene_number):
     """
-    Saves a base64 encoded image to S3 and returns the URL
+    Saves PNG image bytes to S3 and returns a presigned URL for fetching it
     """
     try:
-        image_data = base64.b64decode(image_base64)
         key = f"{story_id}/scene_{scene_number}.png"
         
         s3.put_object(
             Bucket=BUCKET_NAME,
             Key=key,
-            Body=image_data,
+            Body=io.BytesIO(image_data),
             ContentType='image/png'
         )
         
-        url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
+        # Signed locally, so this adds no request
+        url = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': BUCKET_NAME, 'Key': key},
+            ExpiresIn=IMAGE_URL_EXPIRY_SECONDS
+        )
         return url
     except Exception as e:
         print(f"Error saving image to S3: {str(e)}")
         return None
 
-def save_metadata_to_s3(story_id, metadata, scenes):
+def generate_and_upload(scene, story_id, scene_number):
+    """
+    Generates the image for one scene and saves it to S3, returning its URL
+    """
+    print(f"Generating image {scene_number}/5")
+    image_data = image_from_text(scene)
+    return save_image_to_s3(image_data, story_id, scene_number)
+
+def save_metadata_to_s3(story_id, metadata, scenes, executor):
     """
-    Saves metadata and scene information to S3
+    Saves metadata and scene information to S3, uploading both files on the given executor
     """
     try:
         # Save the original metadata
@@ -151,13 +195,6 @@ def save_metadata_to_s3(story_id, metadata, scenes):
             'width': TARGET_WIDTH,
             'height': TARGET_HEIGHT
         }
-        
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/metadata.json",
-            Body=json.dumps(metadata),
-            ContentType='application/json'
-        )
 
         # Create scenes data in the requested format
         scenes_data = {
@@ -165,13 +202,25 @@ def save_metadata_to_s3(story_id, metadata, scenes):
             for i, scene in enumerate(scenes)
         }
 
-        # Save the scenes JSON
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/scenes.json",
-            Body=json.dumps(scenes_data, indent=2),
-            ContentType='application/json'
-        )
+        # Save the metadata and scenes JSON side by side
+        uploads = [
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/metadata.json",
+                Body=json.dumps(metadata, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            ),
+            executor.submit(
+                s3.put_object,
+                Bucket=BUCKET_NAME,
+                Key=f"{story_id}/scenes.json",
+                Body=json.dumps(scenes_data, separators=COMPACT_SEPARATORS),
+                ContentType='application/json'
+            )
+        ]
+        for upload in uploads:
+            upload.result()
         
         return True
     except Exception as e:
@@ -207,7 +256,6 @@ def handler(event, context):
         full_text = story_data['full_text']
         
         print("Generating images for scenes")
-        images = []
         image_urls = []
         
         metadata = {
@@ -220,38 +268,29 @@ def handler(event, context):
             'image_format': 'png'
         }
         
-        # Save metadata and scenes
-        save_metadata_to_s3(story_id, metadata, scenes)
-        
-        # Generate and save images
-        for idx, scene in enumerate(scenes):
-            print(f"Generating image {idx + 1}/5")
-            if idx > 0:
-                time.sleep(2)  # Rate limiting
-            
-            image_base64 = image_from_text(scene)
-            image_url = save_image_to_s3(
-                image_base64,
-                story_id,
-                idx + 1
-            )
-            
-            images.append(image_base64)
-            image_urls.append(image_url)
+        # Generate and save images concurrently; Bedrock throttling is left to the client's retries.
+        # The metadata and scenes uploads share the pool and finish while the images are still generating
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(generate_and_upload, scene, story_id, idx + 1)
+                for idx, scene in enumerate(scenes)
+            ]
+            save_metadata_to_s3(story_id, metadata, scenes, executor)
+            for future in futures:
+                image_urls.append(future.result())
         
         response_data = {
             'story_id': story_id,
             'topic': user_input,
             'scenes': scenes,
             'full_text': full_text,
-            'images': images,
             'image_urls': image_urls,
             'metadata': metadata
         }
 
         return {
             'statusCode': 200,
-            'body': json.dumps(response_data),
+            'body': json.dumps(response_data, separators=COMPACT_SEPARATORS),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
@@ -1,151 +1,37 @@
 import json
 import os
-import boto3
 import logging
 import time
-import random
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import unquote_plus
+
+from story_video_common import (
+    SOURCE_BUCKET,
+    DESTINATION_BUCKET,
+    s3_client,
+    bedrock_client,
+    get_model_input,
+)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Environment variables
-SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', 'story-story-images')
-DESTINATION_BUCKET = os.environ.get('DESTINATION_BUCKET', 'story-video-output')
-AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 MODEL_ID = "amazon.nova-reel-v1:1"
-SLEEP_SECONDS = 15
+# Poll quickly at first so short jobs are noticed early, then settle at MAX_POLL_INTERVAL
+POLL_INTERVALS = [2, 3, 5, 10, 15]
+MAX_POLL_INTERVAL = 30
 MAX_MONITORING_TIME = 900  # 15 minutes maximum monitoring time
 
-def load_scenes_from_s3(bucket: str, story_id: str) -> dict:
-    """Load scenes.json file from S3."""
-    try:
-        s3_client = boto3.client('s3')
-        file_path = f"{story_id}/scenes.json"
-        logger.info(f"Attempting to load scenes.json from {bucket}/{file_path}")
-        
-        response = s3_client.get_object(
-            Bucket=bucket,
-            Key=file_path
-        )
-        scenes = json.loads(response['Body'].read().decode('utf-8'))
-        logger.info(f"Successfully loaded scenes: {json.dumps(scenes, indent=2)}")
-        return scenes
-    except Exception as e:
-        logger.error(f"Error loading scenes.json from {file_path}: {str(e)}")
-        raise
-
-def clean_scene_text(text: str) -> str:
-    """Clean and format scene text."""
-    try:
-        if not text:
-            return ""
-        
-        logger.debug(f"Original text: {text[:100]}...")
-        
-        # Convert to string if needed
-        text = str(text).strip()
-        
-        # Remove markdown formatting
-        text = text.replace('**', '')
-        
-        # Remove numbering if present
-        if text[0].isdigit():
-            parts = text.split('.', 1)
-            if len(parts) > 1:
-                text = parts[1]
-        
-        # Remove any leading/trailing whitespace
-        text = text.strip()
-        
-        logger.debug(f"Cleaned text: {text[:100]}...")
-        return text
-    except Exception as e:
-        logger.warning(f"Error in clean_scene_text: {str(e)}")
-        return text
-
-def check_image_exists(bucket: str, story_id: str, scene_num: int) -> bool:
-    """Check if scene image exists in S3."""
-    try:
-        s3_client = boto3.client('s3')
-        image_path = f"{story_id}/scene_{scene_num}.png"
-        s3_client.head_object(Bucket=bucket, Key=image_path)
-        logger.info(f"Image found: {image_path}")
-        return True
-    except Exception as e:
-        logger.info(f"Image not found: {image_path}")
-        return False
-
-def get_model_input(event: dict) -> dict:
-    """Create model input configuration."""
-    try:
-        story_id = event.get('story_id')
-        if not story_id:
-            raise ValueError("story_id is required in the event")
-        
-        logger.info(f"Processing story_id: {story_id}")
-        
-        # Load scenes
-        scenes = load_scenes_from_s3(SOURCE_BUCKET, story_id)
-        
-        # Create shots array
-        shots = []
-        shot_keys = sorted([k for k in scenes.keys() if k.startswith('shot') and k.endswith('_text')])
-        
-        logger.info(f"Found {len(shot_keys)} shots to process")
-        
-        for shot_key in shot_keys:
-            if scenes[shot_key]:
-                shot_num = int(shot_key.replace('shot', '').replace('_text', ''))
-                
-                # Create shot with cleaned text
-                cleaned_text = clean_scene_text(scenes[shot_key])
-                shot = {
-                    "text": cleaned_text
-                }
-                
-                # Add image if exists
-                if check_image_exists(SOURCE_BUCKET, story_id, shot_num):
-                    shot["image"] = {
-                        "format": "png",
-                        "source": {
-                            "s3Location": {
-                                "uri": f"s3://{SOURCE_BUCKET}/{story_id}/scene_{shot_num}.png"
-                            }
-                        }
-                    }
-                
-                shots.append(shot)
-                logger.info(f"Processed {shot_key} successfully")
-        
-        if not shots:
-            raise ValueError("No valid shots found in scenes.json")
-        
-        model_input = {
-            "taskType": "MULTI_SHOT_MANUAL",
-            "multiShotManualParams": {
-                "shots": shots
-            },
-            "videoGenerationConfig": {
-                "seed": event.get('seed', random.randint(0, 2147483648)),
-                "fps": 24,
-                "dimension": "1280x720"
-            }
-        }
-        
-        logger.info(f"Created model input: {json.dumps(model_input, indent=2)}")
-        return model_input
-        
-    except Exception as e:
-        logger.error(f"Error in get_model_input: {str(e)}")
-        raise
+# Everything written here is read by code, so skip the whitespace json.dumps adds by default
+COMPACT_SEPARATORS = (',', ':')
 
 def monitor_video_generation(bedrock_client, invocation_arn: str) -> Tuple[str, str]:
     """Monitor the video generation process and return status and output location"""
     job_id = invocation_arn.split("/")[-1]
     s3_location = f"s3://{DESTINATION_BUCKET}/{job_id}"
-    start_time = time.time()
+    start_time = time.monotonic()
+    attempt = 0
     
     logger.info(f"Monitoring job folder: {s3_location}")
     
@@ -160,11 +46,12 @@ def monitor_video_generation(bedrock_client, invocation_arn: str) -> Tuple[str,
                 break
                 
             # Check if we've exceeded maximum monitoring time
-            if time.time() - start_time > MAX_MONITORING_TIME:
+            if time.monotonic() - start_time > MAX_MONITORING_TIME:
                 logger.warning("Maximum monitoring time exceeded")
                 return "Timeout", s3_location
                 
-            time.sleep(SLEEP_SECONDS)
+            time.sleep(POLL_INTERVALS[attempt] if attempt < len(POLL_INTERVALS) else MAX_POLL_INTERVAL)
+            attempt += 1
             
         except Exception as e:
             logger.error(f"Error monitoring video generation: {str(e)}")
@@ -190,6 +77,48 @@ def start_video_generation(bedrock_client, model_input: dict) -> Dict:
         logger.error(f"Error starting video generation: {str(e)}")
         raise
 
+def record_invocation(job_id: str, story_id: str, invocation_arn: str) -> None:
+    """Store which story a video job belongs to, for the completion handler to pick up"""
+    s3_client.put_object(
+        Bucket=DESTINATION_BUCKET,
+        Key=f"{job_id}/invocation.json",
+        Body=json.dumps({'story_id': story_id, 'invocation_arn': invocation_arn}, separators=COMPACT_SEPARATORS),
+        ContentType='application/json'
+    )
+
+def handle_video_output(record: dict) -> Optional[Dict[str, Any]]:
+    """Write the final status for a job whose output.mp4 has landed in the destination bucket"""
+    bucket = record['s3']['bucket']['name']
+    key = unquote_plus(record['s3']['object']['key'])
+    # This handler writes invocation.json and status.json into the same bucket, so without the
+    # suffix check their notifications would read as finished videos and re-trigger it
+    if not key.endswith('/output.mp4'):
+        logger.debug("Ignoring notification for %s", key)
+        return None
+    job_id = key.split('/')[0]
+    
+    try:
+        invocation = json.loads(s3_client.get_object(Bucket=bucket, Key=f"{job_id}/invocation.json")['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        logger.warning(f"No invocation metadata found for job {job_id}")
+        invocation = {}
+    
+    status = {
+        'status': 'Completed',
+        'story_id': invocation.get('story_id'),
+        'invocation_arn': invocation.get('invocation_arn'),
+        'output_location': f"s3://{bucket}/{key}",
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{job_id}/status.json",
+        Body=json.dumps(status, separators=COMPACT_SEPARATORS),
+        ContentType='application/json'
+    )
+    logger.info(f"Video generation completed: {json.dumps(status)}")
+    return status
+
 def validate_environment() -> None:
     """Validate required environment variables"""
     if not SOURCE_BUCKET or not DESTINATION_BUCKET:
@@ -213,22 +142,38 @@ def handler(event: dict, context: Any) -> Dict[str, Any]:
         
         # Validate environment
         validate_environment()
+        
+        # S3 notifications for a finished job's output.mp4
+        if 'Records' in event:
+            results = [result for result in map(handle_video_output, event['Records']) if result]
+            return {
+                'statusCode': 200,
+                'body': {
+                    'message': 'Video generation completed successfully',
+                    'results': results
+                }
+            }
 
-        # Initialize Bedrock client
-        bedrock_client = boto3.client(
-            service_name="bedrock-runtime",
-            region_name=AWS_REGION
-        )
+        # Only draw a seed when the event doesn't supply one; Nova Reel accepts 0 to 2,147,483,646
+        seed = event.get('seed')
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), 'little') % 2147483647
         
         # Get model input configuration
-        model_input = get_model_input(event)
+        model_input = get_model_input(event, seed)
         
         # Start video generation
         invocation = start_video_generation(bedrock_client, model_input)
         invocation_arn = invocation["invocationArn"]
+        job_id = invocation_arn.split("/")[-1]
+        record_invocation(job_id, event['story_id'], invocation_arn)
         
-        # Monitor the generation process
-        status, output_location = monitor_video_generation(bedrock_client, invocation_arn)
+        # Completion is reported by the output.mp4 notification, so by default return right away
+        # rather than keep the function billed while it waits. Callers can still ask to wait
+        if event.get('wait_for_completion'):
+            status, output_location = monitor_video_generation(bedrock_client, invocation_arn)
+        else:
+            status, output_location = "InProgress", f"s3://{DESTINATION_BUCKET}/{job_id}/output.mp4"
         
         # Prepare response based on status
         response = {
@@ -252,6 +197,9 @@ def handler(event: dict, context: Any) -> Dict[str, Any]:
         elif status == "Timeout":
             response['statusCode'] = 408
             response['body']['message'] = 'Video generation monitoring timed out'
+        elif status == "InProgress":
+            response['statusCode'] = 202
+            response['body']['message'] = 'Video generation started successfully'
         else:
             response['body']['message'] = f'Video generation status: {status}'
         
@@ -1,6 +1,7 @@
 import json
 import os
 import boto3
+from botocore.config import Config
 import logging
 from typing import Dict, Any
 
@@ -8,14 +9,27 @@ from typing import Dict, Any
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# This function is deployed inline in template.yaml and can't import story_video_common.py,
+# so it carries a copy of it; check_video_helpers.py fails if the two drift apart
+# --- shared video helpers: begin ---
 # Environment variables
 SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', 'story-story-images')
 DESTINATION_BUCKET = os.environ.get('DESTINATION_BUCKET', 'story-video-output')
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+
+# Create the clients once per container instead of on every call, from one session
+# so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+s3_client = session.client('s3')
+bedrock_client = session.client(
+    service_name="bedrock-runtime",
+    region_name=AWS_REGION,
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 5}, tcp_keepalive=True)
+)
 
 def load_scenes_from_s3(bucket: str, story_id: str) -> dict:
     """Load scenes.json file from S3."""
     try:
-        s3_client = boto3.client('s3')
         file_path = f"{story_id}/scenes.json"
         logger.info(f"Attempting to load scenes.json from {bucket}/{file_path}")
         
@@ -24,7 +38,10 @@ def load_scenes_from_s3(bucket: str, story_id: str) -> dict:
             Key=file_path
         )
         scenes = json.loads(response['Body'].read().decode('utf-8'))
-        logger.info(f"Successfully loaded scenes: {json.dumps(scenes, indent=2)}")
+        logger.info(f"Successfully loaded {len(scenes)} scene entries")
+        # Only serialize the full payload when someone is reading DEBUG logs
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Loaded scenes: {json.dumps(scenes)}")
         return scenes
     except Exception as e:
         logger.error(f"Error loading scenes.json from {file_path}: {str(e)}")
@@ -36,45 +53,40 @@ def clean_scene_text(text: str) -> str:
         if not text:
             return ""
         
-        # Log original text
-        logger.debug(f"Original text: {text[:100]}...")
-        
-        # Convert to string if needed
-        text = str(text).strip()
+        logger.debug("Original text: %s...", text[:100])
         
-        # Remove markdown formatting
-        text = text.replace('**', '')
+        # Convert to string if needed and remove markdown formatting
+        text = str(text).strip().replace('**', '')
         
-        # Remove numbering if present
-        if text[0].isdigit():
-            parts = text.split('.', 1)
-            if len(parts) > 1:
-                text = parts[1]
+        # Remove numbering if present; partition finds the first '.' without building a list
+        if text[:1].isdigit():
+            _, dot, rest = text.partition('.')
+            if dot:
+                text = rest
         
         # Remove any leading/trailing whitespace
         text = text.strip()
         
-        # Log cleaned text
-        logger.debug(f"Cleaned text: {text[:100]}...")
-        
+        logger.debug("Cleaned text: %s...", text[:100])
         return text
     except Exception as e:
         logger.warning(f"Error in clean_scene_text: {str(e)}")
         return text
 
-def check_image_exists(bucket: str, story_id: str, scene_num: int) -> bool:
-    """Check if scene image exists in S3."""
-    try:
-        s3_client = boto3.client('s3')
-        image_path = f"{story_id}/scene_{scene_num}.png"
-        s3_client.head_object(Bucket=bucket, Key=image_path)
-        logger.info(f"Image found: {image_path}")
-        return True
-    except Exception as e:
-        logger.info(f"Image not found: {image_path}")
-        return False
+def list_scene_images(bucket: str, story_id: str) -> set:
+    """List the scene numbers that have an image in S3."""
+    prefix = f"{story_id}/scene_"
+    paginator = s3_client.get_paginator('list_objects_v2')
+    existing = set()
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            number = obj['Key'][len(prefix):-len('.png')]
+            if obj['Key'].endswith('.png') and number.isdigit():
+                existing.add(int(number))
+    logger.info(f"Found {len(existing)} scene images for {story_id}")
+    return existing
 
-def get_model_input(event: dict) -> dict:
+def get_model_input(event: dict, seed: int) -> dict:
     """Create model input configuration."""
     try:
         story_id = event.get('story_id')
@@ -83,19 +95,28 @@ def get_model_input(event: dict) -> dict:
         
         logger.info(f"Processing story_id: {story_id}")
         
-        # Load scenes
+        # Load scenes; scenes.json also lists which scenes have an image
         scenes = load_scenes_from_s3(SOURCE_BUCKET, story_id)
+        image_scenes = scenes.get('image_scenes')
+        
+        # Stories whose scenes.json doesn't record their images fall back to one listing
+        if image_scenes is None:
+            image_scenes = list_scene_images(SOURCE_BUCKET, story_id)
+        else:
+            image_scenes = set(image_scenes)
         
         # Create shots array
         shots = []
-        shot_keys = sorted([k for k in scenes.keys() if k.startswith('shot') and k.endswith('_text')])
+        # Sort by shot number, so shot10_text comes after shot9_text rather than after shot1_text
+        shot_items = sorted(
+            (int(k[4:-5]), k) for k in scenes
+            if k.startswith('shot') and k.endswith('_text') and k[4:-5].isdigit()
+        )
         
-        logger.info(f"Found {len(shot_keys)} shots to process")
+        logger.info(f"Found {len(shot_items)} shots to process")
         
-        for shot_key in shot_keys:
+        for shot_num, shot_key in shot_items:
             if scenes[shot_key]:
-                shot_num = int(shot_key.replace('shot', '').replace('_text', ''))
-                
                 # Create shot with cleaned text
                 cleaned_text = clean_scene_text(scenes[shot_key])
                 shot = {
@@ -103,7 +124,7 @@ def get_model_input(event: dict) -> dict:
                 }
                 
                 # Add image if exists
-                if check_image_exists(SOURCE_BUCKET, story_id, shot_num):
+                if shot_num in image_scenes:
                     shot["image"] = {
                         "format": "png",
                         "source": {
@@ -125,18 +146,21 @@ def get_model_input(event: dict) -> dict:
                 "shots": shots
             },
             "videoGenerationConfig": {
-                "seed": event.get('seed', 1234),
+                "seed": seed,
                 "fps": 24,
                 "dimension": "1280x720"
             }
         }
         
-        logger.info(f"Created model input: {json.dumps(model_input, indent=2)}")
+        logger.info(f"Created model input with {len(shots)} shots")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Model input: {json.dumps(model_input)}")
         return model_input
         
     except Exception as e:
         logger.error(f"Error in get_model_input: {str(e)}")
         raise
+# --- shared video helpers: end ---
 
 def lambda_handler(event: dict, context: Any) -> Dict[str, Any]:
     """Lambda function handler."""
@@ -146,12 +170,7 @@ def lambda_handler(event: dict, context: Any) -> Dict[str, Any]:
         if not SOURCE_BUCKET or not DESTINATION_BUCKET:
             raise ValueError("SOURCE_BUCKET and DESTINATION_BUCKET environment variables must be set")
 
-        bedrock_client = boto3.client(
-            service_name="bedrock-runtime",
-            region_name=os.environ.get('AWS_REGION', 'us-east-1')
-        )
-        
-        model_input = get_model_input(event)
+        model_input = get_model_input(event, event.get('seed', 1234))
         
         invocation = bedrock_client.start_async_invoke(
             modelId="amazon.nova-reel-v1:1",
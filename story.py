@@ -1,7 +1,7 @@
 import json
 import boto3
 import base64
-import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
 from datetime import datetime
 import uuid
@@ -15,20 +15,84 @@ BUCKET_NAME = os.environ['BUCKET_NAME']
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 
-# Create the clients
-bedrock = boto3.client(
+# Everything written here is read by code, so skip the whitespace json.dumps adds by default
+COMPACT_SEPARATORS = (',', ':')
+
+# Compiled once per container rather than on every call
+SCENE_PATTERN = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
+SCENE_HEADING_PATTERN = re.compile(r'^.{1,30}:?\s*\n')
+NAME_PATTERN = re.compile(r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)')
+UNSAFE_TOPIC_PATTERN = re.compile(r'[^a-z0-9_]')
+
+# Prompt templates, filled in per request
+STORY_DESCRIPTION_PROMPT = """Create a concise, engaging 30-second narration from this story. 
+        Focus on the main character's journey and key moments.
+        The narration should flow naturally and be suitable for voice-over.
+        Keep it under 100 words while maintaining story impact.
+
+        Story text:
+        {full_text}
+
+        Requirements:
+        - Start with an engaging introduction of the main character
+        - Highlight 2-3 key moments
+        - End with the resolution
+        - Use natural, conversational language
+        - Maintain emotional connection
+        - Keep it concise for 30-second narration
+
+        Format: Single paragraph narrative suitable for voice-over."""
+
+SCENE_STEPS_PROMPT = """Create 5 sequential scenes telling a story about: {user_input}
+
+Story arc requirements:
+1. Scene 1 (Introduction): Establish main character and setting, introduce the basic situation
+2. Scene 2 (Rising Action): Show first challenge or development
+3. Scene 3 (Rising Action): Increase tension or progress
+4. Scene 4 (Climax): Show the peak moment or main achievement
+5. Scene 5 (Resolution): Show the outcome or conclusion
+
+Format each scene as:
+Scene X: [Shot type] - [Character details] - [Action] - [Setting] - [Lighting]
+
+Character consistency:
+- Maintain exact same character description across all scenes
+- Format: Name (age gender, physical details, clothing)
+- Maximum 3 characters per scene
+
+Technical requirements:
+- Each scene under 20 words
+- Include shot type (Close-up, Medium, Wide, Full)
+- Clear lighting conditions
+- Single focused action
+- Simple setting"""
+
+# One worker per scene image
+IMAGE_WORKERS = 5
+
+# Create the clients from one session, so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+
+# The pools cover the concurrent image requests and uploads, which share each client across the
+# workers. Adaptive retries back off on throttling now that the scene images are requested together
+bedrock = session.client(
     service_name='bedrock-runtime',
     region_name="us-east-1",
-    config=Config(read_timeout=300)
+    config=Config(
+        read_timeout=300,
+        max_pool_connections=16,
+        retries={'mode': 'adaptive', 'max_attempts': 5},
+        tcp_keepalive=True
+    )
 )
-s3 = boto3.client('s3')
+s3 = session.client('s3', config=Config(max_pool_connections=16, retries={'mode': 'adaptive'}))
 
 def sanitize_topic(topic):
     """
     Sanitizes the topic string for use in file names
     """
     sanitized = topic.lower().replace(' ', '_')
-    sanitized = re.sub(r'[^a-z0-9_]', '', sanitized)
+    sanitized = UNSAFE_TOPIC_PATTERN.sub('', sanitized)
     return sanitized[:30]
 
 def generate_story_id(topic):
@@ -45,23 +109,7 @@ def generate_story_description(full_text):
     Generates a 30-second narrative from the full story text using Claude
     """
     try:
-        prompt = f"""Create a concise, engaging 30-second narration from this story. 
-        Focus on the main character's journey and key moments.
-        The narration should flow naturally and be suitable for voice-over.
-        Keep it under 100 words while maintaining story impact.
-
-        Story text:
-        {full_text}
-
-        Requirements:
-        - Start with an engaging introduction of the main character
-        - Highlight 2-3 key moments
-        - End with the resolution
-        - Use natural, conversational language
-        - Maintain emotional connection
-        - Keep it concise for 30-second narration
-
-        Format: Single paragraph narrative suitable for voice-over."""
+        prompt = STORY_DESCRIPTION_PROMPT.format(full_text=full_text)
 
         conversation = [
             {
@@ -91,29 +139,7 @@ def generate_story_steps(user_input):
     Generates story scenes using Claude 3 Sonnet through Amazon Bedrock
     """
     try:
-        enhanced_prompt = f"""Create 5 sequential scenes telling a story about: {user_input}
-
-Story arc requirements:
-1. Scene 1 (Introduction): Establish main character and setting, introduce the basic situation
-2. Scene 2 (Rising Action): Show first challenge or development
-3. Scene 3 (Rising Action): Increase tension or progress
-4. Scene 4 (Climax): Show the peak moment or main achievement
-5. Scene 5 (Resolution): Show the outcome or conclusion
-
-Format each scene as:
-Scene X: [Shot type] - [Character details] - [Action] - [Setting] - [Lighting]
-
-Character consistency:
-- Maintain exact same character description across all scenes
-- Format: Name (age gender, physical details, clothing)
-- Maximum 3 characters per scene
-
-Technical requirements:
-- Each scene under 20 words
-- Include shot type (Close-up, Medium, Wide, Full)
-- Clear lighting conditions
-- Single focused action
-- Simple setting"""
+        enhanced_prompt = SCENE_STEPS_PROMPT.format(user_input=user_input)
 
         conversation = [
             {
@@ -134,11 +160,14 @@ Technical requirements:
         )
 
         story_text = response["output"]["message"]["content"][0]["text"]
-        scene_pattern = re.compile(r'(?:Scene\s*\d+|###\s*Scene\s*\d+|\d+\.)')
-        raw_scenes = re.split(scene_pattern, story_text)
-        scenes = [scene.strip() for scene in raw_scenes if scene.strip()]
-        scenes = [re.sub(r'^.{1,30}:?\s*\n', '', scene).strip() for scene in scenes]
-        scenes = scenes[:5]
+        # Strip each chunk once and stop at the fifth scene instead of cleaning text that gets discarded
+        scenes = []
+        for raw_scene in SCENE_PATTERN.split(story_text):
+            scene = raw_scene.strip()
+            if scene:
+                scenes.append(SCENE_HEADING_PATTERN.sub('', scene, count=1).strip())
+                if len(scenes) == 5:
+                    break
         
         while len(scenes) < 5:
             scenes.append(f"Scene {len(scenes) + 1} about {user_input}")
@@ -159,6 +188,7 @@ Technical requirements:
 def image_from_text(text):
     """
     Generates an image from text using Nova-Canvas model with improved parameters
+    and returns the decoded PNG bytes
     """
     body = json.dumps({
         "taskType": "TEXT_IMAGE",
@@ -173,7 +203,7 @@ def image_from_text(text):
             "cfgScale": 8.0,
             "seed": 0
         }
-    })
+    }, separators=COMPACT_SEPARATORS)
 
     response = bedrock.invoke_model(
         body=body,
@@ -183,14 +213,13 @@ def image_from_text(text):
     )
     
     response_body = json.loads(response.get("body").read())
-    return response_body.get("images")[0]
+    return base64.b64decode(response_body.get("images")[0])
 
-def save_image_to_s3(image_base64, story_id, scene_number):
+def save_image_to_s3(image_data, story_id, scene_number):
     """
-    Saves a base64 encoded image to S3 and returns the URL
+    Saves PNG image bytes to S3 and returns the URL
     """
     try:
-        image_data = base64.b64decode(image_base64)
         key = f"{story_id}/scene_{scene_number}.png"
         current_time = datetime.now().isoformat()  
         s3.put_object(
@@ -209,36 +238,38 @@ def save_image_to_s3(image_base64, story_id, scene_number):
     except Exception as e:
         print(f"Error saving image to S3: {str(e)}")
         return None
-def save_metadata_to_s3(story_id, metadata, scenes):
+
+def generate_and_upload(scene, story_id, scene_number):
     """
-    Saves metadata and scene information to S3
+    Generates the image for one scene and saves it to S3, returning the URL
     """
-    try:
-        # Save the original metadata
-        metadata['image_resolution'] = {
-            'width': TARGET_WIDTH,
-            'height': TARGET_HEIGHT
-        }
-        
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=f"{story_id}/metadata.json",
-            Body=json.dumps(metadata),
-            ContentType='application/json'
-        )
+    print(f"Generating image {scene_number}/5")
+    scene_context = f"""Scene {scene_number} of 5:
+            {scene} """
+    image_data = image_from_text(scene_context)
+    image_url = save_image_to_s3(image_data, story_id, scene_number)
+    if not image_url:
+        raise Exception(f"Failed to save image {scene_number} to S3")
+    return image_url
 
+def save_scenes_to_s3(story_id, scenes, image_scenes):
+    """
+    Saves the scene texts to S3 in the shot format the video generator reads, along with
+    the numbers of the scenes that have an image, so it never has to look them up
+    """
+    try:
         # Create scenes data in the requested format
         scenes_data = {
             f"shot{i+1}_text": scene
             for i, scene in enumerate(scenes)
         }
+        scenes_data['image_scenes'] = image_scenes
 
-        # Save the scenes JSON
         current_time = datetime.now().isoformat()  
         s3.put_object(
             Bucket=BUCKET_NAME,
             Key=f"{story_id}/scenes.json",
-            Body=json.dumps(scenes_data, indent=2),
+            Body=json.dumps(scenes_data, separators=COMPACT_SEPARATORS),
             ContentType='application/json',
             Metadata={
                 'created-date': current_time,
@@ -246,6 +277,28 @@ def save_metadata_to_s3(story_id, metadata, scenes):
             }
         )
         
+        return True
+    except Exception as e:
+        print(f"Error saving scenes to S3: {str(e)}")
+        return False
+
+def save_metadata_to_s3(story_id, metadata):
+    """
+    Saves the story metadata to S3
+    """
+    try:
+        metadata['image_resolution'] = {
+            'width': TARGET_WIDTH,
+            'height': TARGET_HEIGHT
+        }
+        
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=f"{story_id}/metadata.json",
+            Body=json.dumps(metadata, separators=COMPACT_SEPARATORS),
+            ContentType='application/json'
+        )
+        
         return True
     except Exception as e:
         print(f"Error saving metadata to S3: {str(e)}")
@@ -279,12 +332,9 @@ def handler(event, context):
         scenes = story_data['scenes']
         full_text = story_data['full_text']
         
-        # Generate the narrative for Polly
-        polly_input = generate_story_description(full_text)
-        
         print("Generating images for scenes")
-        images = []
         image_urls = []
+        image_scenes = []
         
         metadata = {
             'story_id': story_id,
@@ -294,45 +344,34 @@ def handler(event, context):
             'image_urls': image_urls
         }
         
-        # Save metadata and scenes first
-        save_metadata_to_s3(story_id, metadata, scenes)
-        
-        # Generate and save images with character consistency
-        for idx, scene in enumerate(scenes):
-            print(f"Generating image {idx + 1}/5")
+        # Images are independent, so generate them concurrently; Bedrock throttling is left to the client's retries.
+        # The Polly narrative only needs the story text, so it is written alongside them on one more worker
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS + 1) as executor:
+            futures = [
+                executor.submit(generate_and_upload, scene, story_id, idx + 1)
+                for idx, scene in enumerate(scenes)
+            ]
+            description_future = executor.submit(generate_story_description, full_text)
             
-            # Add scene context and character positioning
-            scene_number = idx + 1
-            scene_context = f"""Scene {scene_number} of 5:
-            {scene} """
-            
-            if idx > 0:
-                time.sleep(2)  # Rate limiting between API calls
+            for scene_number, future in enumerate(futures, start=1):
+                try:
+                    image_urls.append(future.result())
+                    image_scenes.append(scene_number)
+                except Exception as img_error:
+                    print(f"Error generating image {scene_number}: {str(img_error)}")
             
-            try:
-                image_base64 = image_from_text(scene_context)
-                image_url = save_image_to_s3(
-                    image_base64,
-                    story_id,
-                    scene_number
-                )
-                
-                if image_url:
-                    images.append(image_base64)
-                    image_urls.append(image_url)
-                else:
-                    raise Exception(f"Failed to save image {scene_number} to S3")
-                
-            except Exception as img_error:
-                print(f"Error generating image {scene_number}: {str(img_error)}")
-                continue
+            # Generate the narrative for Polly
+            polly_input = description_future.result()
         
         # Update metadata with image information
-        metadata['generated_images'] = len(images)
+        metadata['generated_images'] = len(image_urls)
         metadata['image_urls'] = image_urls
         
-        # Save updated metadata
-        save_metadata_to_s3(story_id, metadata, scenes)
+        # Save the scenes and metadata once each, now that both include the images
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            scenes_saved = executor.submit(save_scenes_to_s3, story_id, scenes, image_scenes)
+            save_metadata_to_s3(story_id, metadata)
+            scenes_saved.result()
         
         # Prepare response data
         response_data = {
@@ -347,7 +386,7 @@ def handler(event, context):
 
         return {
             'statusCode': 200,
-            'body': json.dumps(response_data),
+            'body': json.dumps(response_data, separators=COMPACT_SEPARATORS),
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
@@ -378,21 +417,17 @@ def extract_character_details(story_text):
     Extracts and tracks character details from the story
     """
     characters = {}
-    name_pattern = r'([A-Z][a-z]+(?:\s[A-Z][a-z]+)*)'
-    
-    scenes = story_text.split('Scene')
-    for scene in scenes:
-        matches = re.finditer(name_pattern, scene)
-        for match in matches:
-            name = match.group(1)
+    for scene_number, scene in enumerate(story_text.split('Scene'), start=1):
+        sentences = scene.split('.')
+        for name in NAME_PATTERN.findall(scene):
             if name not in characters:
-                sentence = next((s for s in scene.split('.') if name in s), '')
+                sentence = next((s for s in sentences if name in s), '')
                 characters[name] = {
                     'first_appearance': sentence,
-                    'scenes_present': [scenes.index(scene) + 1]
+                    'scenes_present': [scene_number]
                 }
             else:
-                characters[name]['scenes_present'].append(scenes.index(scene) + 1)
+                characters[name]['scenes_present'].append(scene_number)
     
     return characters
 
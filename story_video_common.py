@@ -0,0 +1,160 @@
+import json
+import os
+import boto3
+from botocore.config import Config
+import logging
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# --- shared video helpers: begin ---
+# Environment variables
+SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', 'story-story-images')
+DESTINATION_BUCKET = os.environ.get('DESTINATION_BUCKET', 'story-video-output')
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+
+# Create the clients once per container instead of on every call, from one session
+# so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+s3_client = session.client('s3')
+bedrock_client = session.client(
+    service_name="bedrock-runtime",
+    region_name=AWS_REGION,
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 5}, tcp_keepalive=True)
+)
+
+def load_scenes_from_s3(bucket: str, story_id: str) -> dict:
+    """Load scenes.json file from S3."""
+    try:
+        file_path = f"{story_id}/scenes.json"
+        logger.info(f"Attempting to load scenes.json from {bucket}/{file_path}")
+        
+        response = s3_client.get_object(
+            Bucket=bucket,
+            Key=file_path
+        )
+        scenes = json.loads(response['Body'].read().decode('utf-8'))
+        logger.info(f"Successfully loaded {len(scenes)} scene entries")
+        # Only serialize the full payload when someone is reading DEBUG logs
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Loaded scenes: {json.dumps(scenes)}")
+        return scenes
+    except Exception as e:
+        logger.error(f"Error loading scenes.json from {file_path}: {str(e)}")
+        raise
+
+def clean_scene_text(text: str) -> str:
+    """Clean and format scene text."""
+    try:
+        if not text:
+            return ""
+        
+        logger.debug("Original text: %s...", text[:100])
+        
+        # Convert to string if needed and remove markdown formatting
+        text = str(text).strip().replace('**', '')
+        
+        # Remove numbering if present; partition finds the first '.' without building a list
+        if text[:1].isdigit():
+            _, dot, rest = text.partition('.')
+            if dot:
+                text = rest
+        
+        # Remove any leading/trailing whitespace
+        text = text.strip()
+        
+        logger.debug("Cleaned text: %s...", text[:100])
+        return text
+    except Exception as e:
+        logger.warning(f"Error in clean_scene_text: {str(e)}")
+        return text
+
+def list_scene_images(bucket: str, story_id: str) -> set:
+    """List the scene numbers that have an image in S3."""
+    prefix = f"{story_id}/scene_"
+    paginator = s3_client.get_paginator('list_objects_v2')
+    existing = set()
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            number = obj['Key'][len(prefix):-len('.png')]
+            if obj['Key'].endswith('.png') and number.isdigit():
+                existing.add(int(number))
+    logger.info(f"Found {len(existing)} scene images for {story_id}")
+    return existing
+
+def get_model_input(event: dict, seed: int) -> dict:
+    """Create model input configuration."""
+    try:
+        story_id = event.get('story_id')
+        if not story_id:
+            raise ValueError("story_id is required in the event")
+        
+        logger.info(f"Processing story_id: {story_id}")
+        
+        # Load scenes; scenes.json also lists which scenes have an image
+        scenes = load_scenes_from_s3(SOURCE_BUCKET, story_id)
+        image_scenes = scenes.get('image_scenes')
+        
+        # Stories whose scenes.json doesn't record their images fall back to one listing
+        if image_scenes is None:
+            image_scenes = list_scene_images(SOURCE_BUCKET, story_id)
+        else:
+            image_scenes = set(image_scenes)
+        
+        # Create shots array
+        shots = []
+        # Sort by shot number, so shot10_text comes after shot9_text rather than after shot1_text
+        shot_items = sorted(
+            (int(k[4:-5]), k) for k in scenes
+            if k.startswith('shot') and k.endswith('_text') and k[4:-5].isdigit()
+        )
+        
+        logger.info(f"Found {len(shot_items)} shots to process")
+        
+        for shot_num, shot_key in shot_items:
+            if scenes[shot_key]:
+                # Create shot with cleaned text
+                cleaned_text = clean_scene_text(scenes[shot_key])
+                shot = {
+                    "text": cleaned_text
+                }
+                
+                # Add image if exists
+                if shot_num in image_scenes:
+                    shot["image"] = {
+                        "format": "png",
+                        "source": {
+                            "s3Location": {
+                                "uri": f"s3://{SOURCE_BUCKET}/{story_id}/scene_{shot_num}.png"
+                            }
+                        }
+                    }
+                
+                shots.append(shot)
+                logger.info(f"Processed {shot_key} successfully")
+        
+        if not shots:
+            raise ValueError("No valid shots found in scenes.json")
+        
+        model_input = {
+            "taskType": "MULTI_SHOT_MANUAL",
+            "multiShotManualParams": {
+                "shots": shots
+            },
+            "videoGenerationConfig": {
+                "seed": seed,
+                "fps": 24,
+                "dimension": "1280x720"
+            }
+        }
+        
+        logger.info(f"Created model input with {len(shots)} shots")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Model input: {json.dumps(model_input)}")
+        return model_input
+        
+    except Exception as e:
+        logger.error(f"Error in get_model_input: {str(e)}")
+        raise
+# --- shared video helpers: end ---
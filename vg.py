@@ -1,17 +1,107 @@
 import json
+import hashlib
 import boto3
+from botocore.config import Config
 import os
 import time
+import random
 import logging
-from typing import Dict, Any, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
 from urllib.parse import unquote_plus
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-SLEEP_SECONDS = 15
+# Polling starts at INITIAL_POLL_DELAY and doubles up to MAX_POLL_DELAY
+INITIAL_POLL_DELAY = 2
+MAX_POLL_DELAY = 30
 MAX_MONITORING_TIME = 900
 INPUT_BUCKET = os.environ['SOURCE_BUCKET']
 OUTPUT_BUCKET = os.environ['DESTINATION_BUCKET']
+COMPACT_SEPARATORS = (',', ':')
+# The output settings never change between invocations, so build them once
+VIDEO_CONFIG = {
+    "fps": 24,
+    "dimension": "1280x720",
+    "seed": 42
+}
+# Keys and URI prefix for the five shots, formatted once rather than per shot per invocation
+SHOT_TEXT_KEYS = {i: f"shot{i}_text" for i in range(1, 6)}
+INPUT_URI_PREFIX = f"s3://{INPUT_BUCKET}/"
+# Upper bound on stories started concurrently from one batch invocation
+MAX_STORY_WORKERS = 10
+# Larger batches should be split across invocations rather than run in one
+MAX_BATCH_STORIES = 50
+# Fresh request tokens tried for a story whose earlier identical jobs failed
+MAX_SUBMIT_ATTEMPTS = 5
+# Parsed scenes.json per story_id with its ETag, kept for warm invocations that retry the same story
+SCENE_CACHE_SIZE = 128
+_scene_cache = OrderedDict()
+# Batch invocations read and update the cache from several worker threads
+_scene_cache_lock = threading.Lock()
+
+# Create the clients once per container instead of on every call, from one session
+# so credentials and endpoint data are resolved once
+session = boto3.session.Session()
+s3_client = session.client('s3')
+bedrock_client = session.client(
+    'bedrock-runtime',
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 5}, tcp_keepalive=True)
+)
+
+def warm_client(client, *operation_names):
+    """Build the operation models a client will use so the first request doesn't pay for it"""
+    for name in operation_names:
+        client.meta.service_model.operation_model(name)
+
+# Runs during the init phase, once per container
+warm_client(s3_client, 'HeadBucket', 'GetObject', 'ListObjectsV2', 'PutObject')
+warm_client(bedrock_client, 'StartAsyncInvoke', 'GetAsyncInvoke')
+try:
+    # Resolves credentials and opens the pooled S3 connection before the first request needs it
+    s3_client.head_bucket(Bucket=INPUT_BUCKET)
+except Exception as e:
+    logger.warning(f"Skipping S3 connection warm-up: {str(e)}")
+
+@dataclass
+class VideoRequest:
+    """Validated input for the video generator, from a direct invocation or API Gateway"""
+    story_id: Optional[str] = None
+    story_ids: Optional[List[str]] = None
+    scene_data: Optional[Dict[str, Any]] = None
+    wait_for_completion: bool = False
+
+    @classmethod
+    def from_event(cls, event):
+        if isinstance(event, dict):
+            body = event.get('body', event)
+        else:
+            body = event
+        if isinstance(body, str):
+            body = json.loads(body)
+
+        story_ids = body.get('story_ids')
+        if story_ids is not None:
+            # A bare string would otherwise be fanned out one character at a time
+            valid = isinstance(story_ids, list) and all(isinstance(sid, str) and sid for sid in story_ids)
+            if not valid or not story_ids:
+                raise ValueError("story_ids must be a non-empty list of story IDs")
+            story_ids = list(dict.fromkeys(story_ids))
+            if len(story_ids) > MAX_BATCH_STORIES:
+                raise ValueError(f"story_ids can hold at most {MAX_BATCH_STORIES} stories per invocation")
+
+        request = cls(
+            story_id=body.get('story_id'),
+            story_ids=story_ids,
+            scene_data=body.get('scene_data'),
+            wait_for_completion=bool(body.get('wait_for_completion'))
+        )
+        if not (request.story_id or request.story_ids):
+            raise ValueError("story_id is required")
+        return request
 
 def extract_job_id(response):
     """Extract job ID from Bedrock response"""
@@ -19,7 +109,7 @@ def extract_job_id(response):
         # The requestToken in the response contains the job ID
         request_token = response.get('requestToken')
         if request_token:
-            return request_token.split('-')[0]  # First part of the token is the job ID
+            return request_token.partition('-')[0]  # First part of the token is the job ID
         
         # Alternative: try getting from invocationId
         invocation_id = response.get('invocationId')
@@ -28,112 +118,255 @@ def extract_job_id(response):
         
         # If neither is available, use part of the invocationArn
         invocation_arn = response.get('invocationArn', '')
-        return invocation_arn.split('/')[-1]
+        return invocation_arn.rpartition('/')[2]
         
     except Exception as e:
         logger.error(f"Error extracting job ID: {str(e)}")
         return None
 
-def handler(event, context):
-    s3_client = boto3.client('s3')
-    bedrock_client = boto3.client('bedrock-runtime')
-    
+def load_scene_data(story_id):
+    """Load scenes.json for a story, reusing this container's copy while its ETag still matches"""
+    with _scene_cache_lock:
+        entry = _scene_cache.get(story_id)
+    conditional = {'IfNoneMatch': entry[0]} if entry else {}
     try:
-        if isinstance(event, dict):
-            if 'body' in event:
-                body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
-            else:
-                body = event
-        else:
-            body = json.loads(event)
-
-        story_id = body.get('story_id')
-        if not story_id:
-            raise ValueError("story_id is required")
-
-        logger.info(f"Processing story_id: {story_id}")
-
         scene_json_response = s3_client.get_object(
             Bucket=INPUT_BUCKET,
-            Key=f"{story_id}/scenes.json"
+            Key=f"{story_id}/scenes.json",
+            **conditional
         )
-        scene_data = json.loads(scene_json_response['Body'].read().decode('utf-8'))
-        
-        shots = []
-        for i in range(1, 6):
-            shot = {
-                "text": scene_data[f"shot{i}_text"].strip(),
-                "image": {
-                    "format": "png",
-                    "source": {
-                        "s3Location": {
-                            "uri": f"s3://{INPUT_BUCKET}/{story_id}/scene_{i}.png"
-                        }
-                    }
+    except s3_client.exceptions.ClientError as e:
+        # A 304 means the story hasn't been regenerated since it was cached, so nothing is downloaded
+        if entry and e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+            # Re-insert the held entry; another worker may have evicted it during the request
+            cache_scene_data(story_id, entry)
+            return entry[1]
+        raise
+    
+    # Parse straight from the stream rather than copying the body to bytes and then str
+    with scene_json_response['Body'] as body:
+        scene_data = json.load(body)
+    
+    cache_scene_data(story_id, (scene_json_response['ETag'], scene_data))
+    return scene_data
+
+def cache_scene_data(story_id, entry):
+    """Store an (ETag, scenes) entry as the most recently used, evicting the oldest past the cap"""
+    with _scene_cache_lock:
+        _scene_cache[story_id] = entry
+        _scene_cache.move_to_end(story_id)
+        if len(_scene_cache) > SCENE_CACHE_SIZE:
+            _scene_cache.popitem(last=False)
+
+def list_scene_images(story_id):
+    """List the scene numbers that have an image in the input bucket"""
+    prefix = f"{story_id}/scene_"
+    paginator = s3_client.get_paginator('list_objects_v2')
+    existing = set()
+    for page in paginator.paginate(Bucket=INPUT_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            number = obj['Key'][len(prefix):-len('.png')]
+            if obj['Key'].endswith('.png') and number.isdigit():
+                existing.add(int(number))
+    return existing
+
+def find_scene_images(story_id, scene_data):
+    """Return the scene numbers that have an image, checking S3 only when scenes.json doesn't say"""
+    if 'image_scenes' in scene_data:
+        return set(scene_data['image_scenes'])
+    
+    # One listing of the story's prefix covers all five images in a single round trip
+    return list_scene_images(story_id)
+
+def build_shot(story_id, scene_data, scene_number, has_image):
+    """Build one Nova Reel shot from a scene's text and, when it exists, its image"""
+    shot = {"text": scene_data[SHOT_TEXT_KEYS[scene_number]].strip()}
+    if has_image:
+        shot["image"] = {
+            "format": "png",
+            "source": {
+                "s3Location": {
+                    "uri": f"{INPUT_URI_PREFIX}{story_id}/scene_{scene_number}.png"
                 }
             }
-            shots.append(shot)
-        
-        request_body = {
-            "taskType": "MULTI_SHOT_MANUAL",
-            "multiShotManualParams": {
-                "shots": shots
-            },
-            "videoGenerationConfig": {
-                "fps": 24,
-                "dimension": "1280x720",
-                "seed": 42
-            }
         }
-        
-        logger.info(f"Request body: {json.dumps(request_body, indent=2)}")
-        
-        # Start async video generation
+    return shot
+
+def start_video_job(story_id, request_body):
+    """
+    Start the Nova Reel job, reusing an earlier identical job while it is running or done.
+    Bedrock hands back the original job for a repeated clientRequestToken, so a job that
+    failed is skipped by moving on to the next attempt's token.
+    """
+    base_token = hashlib.sha256(
+        f"{story_id}:{json.dumps(request_body, sort_keys=True, separators=COMPACT_SEPARATORS)}".encode('utf-8')
+    ).hexdigest()[:64]
+    
+    for attempt in range(MAX_SUBMIT_ATTEMPTS):
         invoke_response = bedrock_client.start_async_invoke(
             modelId='amazon.nova-reel-v1:1',
             modelInput=request_body,
+            clientRequestToken=base_token if attempt == 0 else f"{base_token}-{attempt}",
             outputDataConfig={
                 "s3OutputDataConfig": {
                     "s3Uri": f"s3://{OUTPUT_BUCKET}/{story_id}/"
                 }
             }
         )
-        
-        # Extract job ID and invocation ARN
-        job_id = extract_job_id(invoke_response)
-        invocation_arn = invoke_response["invocationArn"]
-        
-        logger.info(f"Started async job with ID: {job_id}")
-        logger.info(f"Invocation ARN: {invocation_arn}")
-        
+        status = bedrock_client.get_async_invoke(invocationArn=invoke_response["invocationArn"])["status"]
+        if status != "Failed":
+            return invoke_response
+        logger.warning("Earlier video job for %s failed, submitting it again", story_id)
+    
+    raise Exception(f"Video generation for {story_id} failed {MAX_SUBMIT_ATTEMPTS} times")
+
+def handle_video_output(record):
+    """Write the final status for a job whose output.mp4 has landed in the output bucket"""
+    bucket = record['s3']['bucket']['name']
+    key = unquote_plus(record['s3']['object']['key'])
+    # status.json below lands in the same bucket; anything but the video must not count as a
+    # completion, or each status write would notify this handler again
+    if not key.endswith('/output.mp4'):
+        logger.debug("Ignoring notification for %s", key)
+        return None
+    # Nova Reel writes to {story_id}/{job_id}/output.mp4 under the prefix the job was started with
+    story_id, _, rest = key.partition('/')
+    job_id = rest.partition('/')[0]
+    
+    status = {
+        'status': 'Completed',
+        'story_id': story_id,
+        'job_id': job_id,
+        'output_location': f"s3://{bucket}/{key}",
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    status_json = json.dumps(status, separators=COMPACT_SEPARATORS)
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{story_id}/{job_id}/status.json",
+        Body=status_json,
+        ContentType='application/json'
+    )
+    logger.info("Video generation completed: %s", status_json)
+    return status
+
+def process_story(story_id, scene_data=None, wait_for_completion=False):
+    """Start the Nova Reel job for one story and build its response"""
+    logger.info("Processing story_id: %s", story_id)
+
+    # Callers that already hold the scenes can pass them inline and skip the S3 read
+    if scene_data is None:
+        scene_data = load_scene_data(story_id)
+
+    # A shot pointing at a missing image would only fail once the job is running
+    image_scenes = find_scene_images(story_id, scene_data)
+
+    shots = [build_shot(story_id, scene_data, i, i in image_scenes) for i in SHOT_TEXT_KEYS]
+
+    request_body = {
+        "taskType": "MULTI_SHOT_MANUAL",
+        "multiShotManualParams": {
+            "shots": shots
+        },
+        "videoGenerationConfig": VIDEO_CONFIG
+    }
+
+    # Serializing the whole request is only worth it when someone is debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request body: %s", json.dumps(request_body))
+
+    # A retried invocation gets the original job back from Bedrock instead of paying for a
+    # second generation, unless that job failed
+    invoke_response = start_video_job(story_id, request_body)
+
+    # Extract job ID and invocation ARN
+    job_id = extract_job_id(invoke_response)
+    invocation_arn = invoke_response["invocationArn"]
+
+    logger.info("Started async job with ID: %s", job_id)
+    logger.info("Invocation ARN: %s", invocation_arn)
+
+    # Completion is reported by the output.mp4 notification, so by default return right away
+    # rather than keep the function billed while it waits. Callers can still ask to wait
+    if wait_for_completion:
         status, output_location = monitor_video_generation(
             bedrock_client, 
             invocation_arn, 
             story_id,
             job_id
         )
+    else:
+        status, output_location = "InProgress", None
+
+    response = {
+        'status': status,
+        'story_id': story_id,
+        'source_bucket': INPUT_BUCKET,
+        'destination_bucket': OUTPUT_BUCKET,
+        'output_location': output_location or f"s3://{OUTPUT_BUCKET}/{story_id}/{job_id}/output.mp4",
+        'job_id': job_id,
+        # Lets an orchestrator check on the job with GetAsyncInvoke without this function waiting
+        'invocation_arn': invocation_arn,
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
 
-        response = {
-            'status': status,
+    if status == "Completed":
+        response['message'] = 'Video generation completed successfully'
+    elif status == "Failed":
+        response['message'] = 'Video generation failed'
+    elif status == "Timeout":
+        response['message'] = 'Video generation monitoring timed out'
+    elif status == "InProgress":
+        response['message'] = 'Video generation started successfully'
+    else:
+        response['message'] = f'Video generation status: {status}'
+
+    # Every value is already a string, so there is nothing for default=str to convert
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Final response: %s", json.dumps(response, separators=COMPACT_SEPARATORS))
+    return response
+
+def process_story_safely(story_id, wait_for_completion=False):
+    """Run process_story for one story of a batch, reporting its failure without failing the rest"""
+    try:
+        return process_story(story_id, wait_for_completion=wait_for_completion)
+    except Exception as err:
+        logger.error(f"Error processing story {story_id}: {str(err)}", exc_info=True)
+        return {
+            'error': str(err),
+            'status': 'Error',
             'story_id': story_id,
-            'source_bucket': INPUT_BUCKET,
-            'destination_bucket': OUTPUT_BUCKET,
-            'output_location': output_location or f"s3://{OUTPUT_BUCKET}/{story_id}/{job_id}/output.mp4",
-            'job_id': job_id,
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
         }
+
+def handler(event, context):
+    try:
+        # S3 notifications for a finished job's output.mp4
+        if isinstance(event, dict) and 'Records' in event:
+            results = [result for result in map(handle_video_output, event['Records']) if result]
+            return {
+                'status': 'Completed',
+                'message': 'Video generation completed successfully',
+                'results': results
+            }
         
-        if status == "Completed":
-            response['message'] = 'Video generation completed successfully'
-        elif status == "Failed":
-            response['message'] = 'Video generation failed'
-        elif status == "Timeout":
-            response['message'] = 'Video generation monitoring timed out'
-        else:
-            response['message'] = f'Video generation status: {status}'
-            
-        logger.info(f"Final response: {json.dumps(response, default=str)}")
-        return response
+        request = VideoRequest.from_event(event)
+
+        if request.story_ids:
+            # One invocation can start several stories, sharing this container's clients.
+            # Each story reads its own scenes.json; inline scene_data only applies to story_id
+            story_ids = request.story_ids
+            with ThreadPoolExecutor(max_workers=min(MAX_STORY_WORKERS, len(story_ids))) as executor:
+                results = list(executor.map(
+                    lambda sid: process_story_safely(sid, request.wait_for_completion), story_ids
+                ))
+            return {
+                'status': 'Submitted',
+                'results': results,
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+        return process_story(request.story_id, request.scene_data, request.wait_for_completion)
 
     except Exception as err:
         logger.error(f"Error in lambda_handler: {str(err)}", exc_info=True)
@@ -144,34 +377,37 @@ def handler(event, context):
         }
 
 def monitor_video_generation(bedrock_client, invocation_arn: str, story_id: str, job_id: str) -> Tuple[str, str]:
-    start_time = time.time()
+    start_time = time.monotonic()
+    delay = INITIAL_POLL_DELAY
     
-    logger.info(f"Monitoring job with ID: {job_id}")
+    logger.info("Monitoring job with ID: %s", job_id)
     expected_path = f"{story_id}/{job_id}/output.mp4"
-    logger.info(f"Expected output path: {expected_path}")
+    logger.info("Expected output path: %s", expected_path)
     
+    # Check before the first sleep so a job that has already finished (a retried submission
+    # returns the original job) is reported without waiting
     while True:
         try:
             response = bedrock_client.get_async_invoke(invocationArn=invocation_arn)
             status = response["status"]
-            logger.info(f"Status: {status}")
+            logger.info("Status: %s", status)
             
+            if status == "Completed":
+                output_location = f"s3://{OUTPUT_BUCKET}/{expected_path}"
+                logger.info("Job completed. Output at: %s", output_location)
+                return status, output_location
             if status != "InProgress":
-                break
+                return status, None
                     
-            if time.time() - start_time > MAX_MONITORING_TIME:
+            remaining = MAX_MONITORING_TIME - (time.monotonic() - start_time)
+            if remaining <= 0:
                 logger.warning("Maximum monitoring time exceeded")
                 return "Timeout", None
-                    
-            time.sleep(SLEEP_SECONDS)
+            
+            # Short jobs are noticed within seconds; jitter keeps concurrent monitors from polling in lockstep
+            time.sleep(min(delay + random.uniform(0, delay * 0.1), remaining))
+            delay = min(delay * 2, MAX_POLL_DELAY)
                 
         except Exception as e:
             logger.error(f"Error monitoring video generation: {str(e)}")
             return "Error", None
-
-    if status == "Completed":
-        output_location = f"s3://{OUTPUT_BUCKET}/{expected_path}"
-        logger.info(f"Job completed. Output at: {output_location}")
-        return status, output_location
-    
-    return status, None